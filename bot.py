@@ -1,68 +1,116 @@
+import time
+
+# Отсчёт холодного старта — до импортов aiogram и asyncpg
+STARTED_AT = time.perf_counter()
+
 import os
+import re
 import logging
 import asyncio
-from datetime import datetime, timedelta
+from datetime import date, timedelta
 
 from aiogram import Bot, Dispatcher, Router, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import (
     Message, CallbackQuery,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from database import Database
+from broadcast import BroadcastWorker
+from callbacks import (
+    CallbackTable, Home, GetMail, MyMails, AdminPanel, Upload, ManageMails,
+    DeleteUnused, ConfirmDeleteUnused, DeleteUsed, ConfirmDeleteUsed, DeleteAll, ConfirmDeleteAll,
+    Stats, Trend, Broadcast, BroadcastRestock, BroadcastSend, BroadcastCancel, BroadcastStop,
+    LimitMenu, SetLimit, LimitMode, Users, UserProfile, UserMails, UserLimit, SetUserLimit, SetUserTier
+)
+from database import open_database
+from imports import ImportWorker
+from mailfilter import MailFilter
+from middlewares import AntiFloodMiddleware
+from quota import QuotaEngine
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+# Свой сервер Bot API, например loadtest/fake_api.py для нагрузочных прогонов
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
-bot = Bot(token=BOT_TOKEN)
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
 dp = Dispatcher(storage=MemoryStorage())
 router = Router()
 dp.include_router(router)
+# Все инлайн-кнопки — один хендлер с таблицей префиксов, см. callbacks.py
+callback_table = CallbackTable()
+router.callback_query.register(callback_table.dispatch)
+dp.callback_query.outer_middleware(AntiFloodMiddleware(exempt={ADMIN_ID}))
 
-db = Database()
+db = open_database()
+first_update_pending = True
+quota = QuotaEngine(db)
+mail_filter = MailFilter(db)
 
 
 # ==================== КЛАВИАТУРЫ ====================
 
 def main_menu_kb(user_id: int):
     buttons = [
-        [InlineKeyboardButton(text="📧 Получить почту", callback_data="get_mail")],
-        [InlineKeyboardButton(text="📋 Мои почты", callback_data="my_mails")],
+        [InlineKeyboardButton(text="📧 Получить почту", callback_data=GetMail().pack())],
+        [InlineKeyboardButton(text="📋 Мои почты", callback_data=MyMails().pack())],
     ]
     if user_id == ADMIN_ID:
-        buttons.append([InlineKeyboardButton(text="🔐 Админ-панель", callback_data="admin")])
+        buttons.append([InlineKeyboardButton(text="🔐 Админ-панель", callback_data=AdminPanel().pack())])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
 def home_kb(user_id: int):
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="home")]
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data=Home().pack())]
     ])
 
 
 def admin_kb():
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📤 Загрузить почты", callback_data="upload")],
-        [InlineKeyboardButton(text="🗑 Управление почтами", callback_data="manage_mails")],
-        [InlineKeyboardButton(text="👥 Пользователи", callback_data="users")],
-        [InlineKeyboardButton(text="⚙️ Лимит почт/день", callback_data="limit")],
-        [InlineKeyboardButton(text="📊 Статистика", callback_data="stats")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="home")],
+        [InlineKeyboardButton(text="📤 Загрузить почты", callback_data=Upload().pack())],
+        [InlineKeyboardButton(text="🗑 Управление почтами", callback_data=ManageMails().pack())],
+        [InlineKeyboardButton(text="👥 Пользователи", callback_data=Users().pack())],
+        [InlineKeyboardButton(text="⚙️ Лимит почт/день", callback_data=LimitMenu().pack())],
+        [InlineKeyboardButton(text="📊 Статистика", callback_data=Stats().pack())],
+        [InlineKeyboardButton(text="📢 Рассылка", callback_data=Broadcast().pack())],
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data=Home().pack())],
     ])
 
 
+def quota_mode_button(rolling: bool):
+    label = "🕐 Окно: скользящие 24 часа" if rolling else "📅 Окно: календарный день"
+    return [InlineKeyboardButton(text=label, callback_data=LimitMode().pack())]
+
+
 def back_admin_kb():
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Админ-панель", callback_data="admin")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="home")],
+        [InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())],
+        [InlineKeyboardButton(text="🏠 Главное меню", callback_data=Home().pack())],
     ])
 
 
+def restock_kb():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📢 Сообщить о пополнении", callback_data=BroadcastRestock().pack())],
+        [InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())],
+    ])
+
+
+importer = ImportWorker(bot, db, mail_filter, back_admin_kb(), restock_kb())
+broadcaster = BroadcastWorker(bot, db)
+
+
 # ==================== /start ====================
 
 @router.message(CommandStart())
@@ -82,7 +130,7 @@ async def cmd_start(message: Message):
 
 # ==================== ГЛАВНОЕ МЕНЮ ====================
 
-@router.callback_query(F.data == "home")
+@callback_table(Home)
 async def go_home(callback: CallbackQuery):
     uid = callback.from_user.id
     role = "👑 Админ" if uid == ADMIN_ID else "👤 Пользователь"
@@ -97,26 +145,37 @@ async def go_home(callback: CallbackQuery):
 
 # ==================== ПОЛУЧИТЬ ПОЧТУ ====================
 
-@router.callback_query(F.data == "get_mail")
+@callback_table(GetMail)
 async def get_mail(callback: CallbackQuery):
     uid = callback.from_user.id
     await db.add_user(uid, callback.from_user.username or "", callback.from_user.full_name)
 
-    daily_limit = await db.get_daily_limit()
-    today_count = await db.get_user_today_count(uid)
-
-    if today_count >= daily_limit:
+    async with quota.user_lock(uid):
+        quota_state = await quota.check(uid)
+        taken = await db.take_mail(uid) if quota_state.allowed else None
+        if taken is not None:
+            quota.commit(uid, taken[1])
+
+    if not quota_state.allowed:
+        if quota_state.rolling:
+            period = "за последние 24 часа"
+            when = (
+                f"Следующая почта будет доступна в <b>{quota_state.reset_at.strftime('%H:%M')}</b>."
+                if quota_state.reset_at else "Обратитесь к админу."
+            )
+        else:
+            period = "сегодня"
+            when = "Возвращайтесь завтра!"
         await callback.message.edit_text(
             f"⛔ <b>Лимит исчерпан</b>\n\n"
-            f"Вы получили <b>{today_count}</b> из <b>{daily_limit}</b> почт сегодня.\n"
-            f"Возвращайтесь завтра!",
+            f"Вы получили <b>{quota_state.used}</b> из <b>{quota_state.limit}</b> почт {period}.\n"
+            f"{when}",
             parse_mode="HTML",
             reply_markup=home_kb(uid)
         )
         return
 
-    mail = await db.take_mail(uid)
-    if mail is None:
+    if taken is None:
         # Уведомляем пользователя
         admin_link = f"tg://user?id={ADMIN_ID}"
         await callback.message.edit_text(
@@ -138,13 +197,15 @@ async def get_mail(callback: CallbackQuery):
                 f"Загрузите новый .txt файл.",
                 parse_mode="HTML",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📤 Загрузить почты", callback_data="upload")],
+                    [InlineKeyboardButton(text="📤 Загрузить почты", callback_data=Upload().pack())],
                 ])
             )
         except Exception:
             pass
         return
 
+    mail, _ = taken
+
     # Проверяем остаток почт в базе и уведомляем админа
     LOW_STOCK_THRESHOLD = 10
     available = await db.count_available_mails()
@@ -157,24 +218,25 @@ async def get_mail(callback: CallbackQuery):
                 f"Рекомендуется загрузить новые.",
                 parse_mode="HTML",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="📤 Загрузить почты", callback_data="upload")],
+                    [InlineKeyboardButton(text="📤 Загрузить почты", callback_data=Upload().pack())],
                 ])
             )
         except Exception:
             pass
 
-    remaining = daily_limit - today_count - 1
+    remaining = quota_state.remaining - 1
+    period = "за 24 часа" if quota_state.rolling else "сегодня"
 
     buttons = []
     if remaining > 0:
-        buttons.append([InlineKeyboardButton(text=f"📧 Получить ещё ({remaining} осталось)", callback_data="get_mail")])
-    buttons.append([InlineKeyboardButton(text="📋 Мои почты", callback_data="my_mails")])
-    buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="home")])
+        buttons.append([InlineKeyboardButton(text=f"📧 Получить ещё ({remaining} осталось)", callback_data=GetMail().pack())])
+    buttons.append([InlineKeyboardButton(text="📋 Мои почты", callback_data=MyMails().pack())])
+    buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data=Home().pack())])
 
     await callback.message.edit_text(
         f"✅ <b>Почта получена!</b>\n\n"
         f"📧 <code>{mail}</code>\n\n"
-        f"Использовано сегодня: <b>{today_count + 1}</b> из <b>{daily_limit}</b>",
+        f"Использовано {period}: <b>{quota_state.used + 1}</b> из <b>{quota_state.limit}</b>",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
     )
@@ -182,7 +244,7 @@ async def get_mail(callback: CallbackQuery):
 
 # ==================== МОИ ПОЧТЫ ====================
 
-@router.callback_query(F.data == "my_mails")
+@callback_table(MyMails)
 async def my_mails(callback: CallbackQuery):
     uid = callback.from_user.id
     rows = await db.get_user_mails(uid)
@@ -194,8 +256,8 @@ async def my_mails(callback: CallbackQuery):
             "Нажмите кнопку ниже чтобы получить первую!",
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="📧 Получить почту", callback_data="get_mail")],
-                [InlineKeyboardButton(text="🏠 Главное меню", callback_data="home")],
+                [InlineKeyboardButton(text="📧 Получить почту", callback_data=GetMail().pack())],
+                [InlineKeyboardButton(text="🏠 Главное меню", callback_data=Home().pack())],
             ])
         )
         return
@@ -212,22 +274,21 @@ async def my_mails(callback: CallbackQuery):
         text,
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📧 Получить ещё", callback_data="get_mail")],
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="home")],
+            [InlineKeyboardButton(text="📧 Получить ещё", callback_data=GetMail().pack())],
+            [InlineKeyboardButton(text="🏠 Главное меню", callback_data=Home().pack())],
         ])
     )
 
 
 # ==================== АДМИН-ПАНЕЛЬ ====================
 
-@router.callback_query(F.data == "admin")
+@callback_table(AdminPanel)
 async def admin_panel(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
-    available = await db.count_available_mails()
-    used = await db.count_used_mails()
+    available, used = await db.count_mails()
     limit = await db.get_daily_limit()
 
     await callback.message.edit_text(
@@ -243,7 +304,7 @@ async def admin_panel(callback: CallbackQuery):
 
 # ==================== ЗАГРУЗИТЬ ПОЧТЫ ====================
 
-@router.callback_query(F.data == "upload")
+@callback_table(Upload)
 async def upload_prompt(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
@@ -254,7 +315,8 @@ async def upload_prompt(callback: CallbackQuery):
         "Отправьте <b>.txt файл</b> в этот чат.\n\n"
         "Формат — каждая строка:\n"
         "<code>email@example.com:password</code>\n\n"
-        "Дубликаты будут автоматически пропущены.",
+        "Повторы почт (даже с другим паролем)\n"
+        "будут автоматически пропущены.",
         parse_mode="HTML",
         reply_markup=back_admin_kb()
     )
@@ -276,45 +338,41 @@ async def handle_document(message: Message):
         )
         return
 
-    wait_msg = await message.answer("⏳ Обрабатываю файл...")
+    wait_msg = await message.answer("⏳ Ставлю файл в очередь...")
 
-    file = await bot.download(doc)
-    content = file.read().decode("utf-8", errors="ignore")
-    lines = [line.strip() for line in content.splitlines() if line.strip() and ":" in line]
-
-    if not lines:
+    job_id, created = await db.create_import_job(
+        doc.file_id, doc.file_unique_id, doc.file_name, message.chat.id, wait_msg.message_id
+    )
+    if not created:
         await wait_msg.edit_text(
-            "❌ <b>Файл пустой или неверный формат</b>\n\n"
-            "Не найдено строк в формате <code>почта:пароль</code>\n"
-            "Проверьте содержимое файла.",
+            f"ℹ️ Этот файл уже загружается — задача <b>#{job_id}</b>.",
             parse_mode="HTML",
             reply_markup=back_admin_kb()
         )
         return
 
-    added, duplicates = await db.add_mails_bulk(lines)
-    available = await db.count_available_mails()
-
+    ahead = await db.count_queued_imports(job_id)
+    queue = f"Перед ней в очереди: <b>{ahead}</b>\n" if ahead else ""
     await wait_msg.edit_text(
-        f"✅ <b>Загрузка завершена!</b>\n\n"
-        f"📥 Новых почт добавлено: <b>{added}</b>\n"
-        f"⚠️ Дубликатов пропущено: <b>{duplicates}</b>\n\n"
-        f"📦 Всего доступно сейчас: <b>{available}</b>",
+        f"⏳ <b>Загрузка #{job_id} в очереди</b>\n\n"
+        f"📄 {doc.file_name}\n"
+        f"{queue}"
+        f"Это сообщение обновится, когда файл будет обработан.",
         parse_mode="HTML",
         reply_markup=back_admin_kb()
     )
+    importer.wake()
 
 
 # ==================== УПРАВЛЕНИЕ ПОЧТАМИ ====================
 
-@router.callback_query(F.data == "manage_mails")
+@callback_table(ManageMails)
 async def manage_mails(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
-    available = await db.count_available_mails()
-    used = await db.count_used_mails()
+    available, used = await db.count_mails()
 
     await callback.message.edit_text(
         f"🗑 <b>Управление почтами</b>\n\n"
@@ -324,15 +382,15 @@ async def manage_mails(callback: CallbackQuery):
         f"Выберите что удалить:",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🗑 Удалить неиспользованные", callback_data="del_unused")],
-            [InlineKeyboardButton(text="🗑 Удалить использованные", callback_data="del_used")],
-            [InlineKeyboardButton(text="⚠️ Удалить ВСЕ почты", callback_data="del_all")],
-            [InlineKeyboardButton(text="◀️ Админ-панель", callback_data="admin")],
+            [InlineKeyboardButton(text="🗑 Удалить неиспользованные", callback_data=DeleteUnused().pack())],
+            [InlineKeyboardButton(text="🗑 Удалить использованные", callback_data=DeleteUsed().pack())],
+            [InlineKeyboardButton(text="⚠️ Удалить ВСЕ почты", callback_data=DeleteAll().pack())],
+            [InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())],
         ])
     )
 
 
-@router.callback_query(F.data == "del_unused")
+@callback_table(DeleteUnused)
 async def del_unused_confirm(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
@@ -350,32 +408,33 @@ async def del_unused_confirm(callback: CallbackQuery):
         f"Это действие нельзя отменить!",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"✅ Да, удалить {count} почт", callback_data="confirm_del_unused")],
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="manage_mails")],
+            [InlineKeyboardButton(text=f"✅ Да, удалить {count} почт", callback_data=ConfirmDeleteUnused().pack())],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data=ManageMails().pack())],
         ])
     )
 
 
-@router.callback_query(F.data == "confirm_del_unused")
+@callback_table(ConfirmDeleteUnused)
 async def confirm_del_unused(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
     deleted = await db.delete_unused_mails()
+    mail_filter.invalidate()
     await callback.message.edit_text(
         f"✅ <b>Удалено!</b>\n\n"
         f"Удалено <b>{deleted}</b> неиспользованных почт.\n\n"
         f"Теперь можете загрузить новые.",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📤 Загрузить почты", callback_data="upload")],
-            [InlineKeyboardButton(text="◀️ Админ-панель", callback_data="admin")],
+            [InlineKeyboardButton(text="📤 Загрузить почты", callback_data=Upload().pack())],
+            [InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())],
         ])
     )
 
 
-@router.callback_query(F.data == "del_used")
+@callback_table(DeleteUsed)
 async def del_used_confirm(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
@@ -394,19 +453,20 @@ async def del_used_confirm(callback: CallbackQuery):
         f"Это действие нельзя отменить!",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"✅ Да, удалить {count} почт", callback_data="confirm_del_used")],
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="manage_mails")],
+            [InlineKeyboardButton(text=f"✅ Да, удалить {count} почт", callback_data=ConfirmDeleteUsed().pack())],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data=ManageMails().pack())],
         ])
     )
 
 
-@router.callback_query(F.data == "confirm_del_used")
+@callback_table(ConfirmDeleteUsed)
 async def confirm_del_used(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
     deleted = await db.delete_used_mails()
+    mail_filter.invalidate()
     await callback.message.edit_text(
         f"✅ <b>Удалено!</b>\n\n"
         f"Удалено <b>{deleted}</b> использованных почт.",
@@ -415,14 +475,13 @@ async def confirm_del_used(callback: CallbackQuery):
     )
 
 
-@router.callback_query(F.data == "del_all")
+@callback_table(DeleteAll)
 async def del_all_confirm(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
-    available = await db.count_available_mails()
-    used = await db.count_used_mails()
+    available, used = await db.count_mails()
     total = available + used
     if total == 0:
         await callback.answer("База почт уже пуста", show_alert=True)
@@ -438,19 +497,20 @@ async def del_all_confirm(callback: CallbackQuery):
         f"Это действие <b>НЕЛЬЗЯ</b> отменить!",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"🚨 Да, удалить ВСЕ {total} почт", callback_data="confirm_del_all")],
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="manage_mails")],
+            [InlineKeyboardButton(text=f"🚨 Да, удалить ВСЕ {total} почт", callback_data=ConfirmDeleteAll().pack())],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data=ManageMails().pack())],
         ])
     )
 
 
-@router.callback_query(F.data == "confirm_del_all")
+@callback_table(ConfirmDeleteAll)
 async def confirm_del_all(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
     deleted = await db.delete_all_mails()
+    mail_filter.invalidate()
     await callback.message.edit_text(
         f"✅ <b>Всё удалено!</b>\n\n"
         f"Удалено <b>{deleted}</b> почт.\n"
@@ -458,24 +518,24 @@ async def confirm_del_all(callback: CallbackQuery):
         f"Загрузите новый файл.",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📤 Загрузить почты", callback_data="upload")],
-            [InlineKeyboardButton(text="◀️ Админ-панель", callback_data="admin")],
+            [InlineKeyboardButton(text="📤 Загрузить почты", callback_data=Upload().pack())],
+            [InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())],
         ])
     )
 
 
 # ==================== СТАТИСТИКА ====================
 
-@router.callback_query(F.data == "stats")
+@callback_table(Stats)
 async def stats(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
     available = await db.count_available_mails()
-    used = await db.count_used_mails()
+    used = await db.count_issued_total()
     total_users = await db.count_users()
-    active_users = len(await db.get_active_users())
+    active_users = await db.count_issuing_users()
     daily_limit = await db.get_daily_limit()
     today_given = await db.count_today_given()
 
@@ -491,13 +551,169 @@ async def stats(callback: CallbackQuery):
         f"<b>Настройки:</b>\n"
         f"   ⚙️ Лимит: <b>{daily_limit}</b> почт/день",
         parse_mode="HTML",
-        reply_markup=back_admin_kb()
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📈 Динамика по дням", callback_data=Trend().pack())],
+            [InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())],
+            [InlineKeyboardButton(text="🏠 Главное меню", callback_data=Home().pack())],
+        ])
+    )
+
+
+@callback_table(Trend)
+async def trend(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    days = 14
+    rows = {row['day']: row['issued'] for row in await db.get_daily_issuance(days)}
+    today = (await db.now()).date()
+    series = [(day, rows.get(day, 0)) for day in (today - timedelta(days=i) for i in range(days - 1, -1, -1))]
+    peak = max(issued for _, issued in series) or 1
+
+    text = f"📈 <b>Выдача по дням</b> — последние {days} дн.\n\n"
+    for day, issued in series:
+        bar = "▇" * round(issued / peak * 12)
+        text += f"<code>{day.strftime('%d.%m')}</code> {bar} {issued}\n"
+    text += f"\nВсего за период: <b>{sum(issued for _, issued in series)}</b>"
+
+    await callback.message.edit_text(
+        text,
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="◀️ Статистика", callback_data=Stats().pack())],
+            [InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())],
+        ])
     )
 
 
+# ==================== РАССЫЛКА ====================
+
+class BroadcastForm(StatesGroup):
+    text = State()
+
+
+RESTOCK_TEXT = (
+    "📦 <b>Почты пополнены!</b>\n\n"
+    "Свободные почты снова есть — нажмите /start, чтобы получить."
+)
+
+
+async def broadcast_confirm(message: Message, text: str, edit: bool):
+    total = await db.count_reachable_users()
+    body = (
+        f"📢 <b>Рассылка</b> — получателей: <b>{total}</b>\n\n"
+        f"Сообщение:\n"
+        f"──────────\n"
+        f"{text}\n"
+        f"──────────"
+    )
+    markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"✅ Отправить {total} пользователям", callback_data=BroadcastSend().pack())],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data=BroadcastCancel().pack())],
+    ])
+    if edit:
+        await message.edit_text(body, parse_mode="HTML", reply_markup=markup)
+    else:
+        await message.answer(body, parse_mode="HTML", reply_markup=markup)
+
+
+@callback_table(Broadcast)
+async def broadcast_prompt(callback: CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    total = await db.count_reachable_users()
+    await state.set_state(BroadcastForm.text)
+    await callback.message.edit_text(
+        f"📢 <b>Рассылка</b>\n\n"
+        f"Отправьте текст сообщения следующим сообщением.\n"
+        f"Форматирование сохранится.\n\n"
+        f"👥 Получателей: <b>{total}</b>\n"
+        f"<i>Заблокировавшие бота пропускаются.</i>",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отмена", callback_data=BroadcastCancel().pack())],
+        ])
+    )
+
+
+@callback_table(BroadcastRestock)
+async def broadcast_restock(callback: CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    await state.set_state(None)
+    await state.update_data(broadcast_text=RESTOCK_TEXT)
+    await broadcast_confirm(callback.message, RESTOCK_TEXT, edit=True)
+
+
+@router.message(BroadcastForm.text)
+async def broadcast_text(message: Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    if not message.text:
+        await message.answer("❌ Нужен текст сообщения. Попробуйте ещё раз.")
+        return
+
+    await state.set_state(None)
+    await state.update_data(broadcast_text=message.html_text)
+    await broadcast_confirm(message, message.html_text, edit=False)
+
+
+@callback_table(BroadcastSend)
+async def broadcast_send(callback: CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    data = await state.get_data()
+    text = data.get("broadcast_text")
+    await state.clear()
+    if not text:
+        await callback.answer("Текст рассылки не найден, начните заново", show_alert=True)
+        return
+
+    total = await db.count_reachable_users()
+    broadcast_id = await db.create_broadcast(text, callback.message.chat.id, callback.message.message_id, total)
+    await callback.message.edit_text(
+        f"⏳ <b>Рассылка #{broadcast_id} в очереди</b>\n\n"
+        f"Получателей: <b>{total}</b>\n"
+        f"Это сообщение будет обновляться.",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⏹ Остановить", callback_data=BroadcastStop(broadcast_id).pack())],
+        ])
+    )
+    broadcaster.wake()
+
+
+@callback_table(BroadcastCancel)
+async def broadcast_cancel(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await admin_panel(callback)
+
+
+@callback_table(BroadcastStop)
+async def broadcast_stop(callback: CallbackQuery, callback_data: BroadcastStop):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    broadcast_id = callback_data.broadcast_id
+    if await db.finish_broadcast(broadcast_id, "cancelled"):
+        broadcaster.cancel(broadcast_id)
+        await callback.answer("⏹ Рассылка останавливается")
+    else:
+        await callback.answer("Рассылка уже завершена")
+
+
 # ==================== ЛИМИТ ====================
 
-@router.callback_query(F.data == "limit")
+@callback_table(LimitMenu)
 async def limit_menu(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
@@ -510,47 +726,53 @@ async def limit_menu(callback: CallbackQuery):
     row = []
     for val in values:
         label = f"✅ {val}" if val == current else str(val)
-        row.append(InlineKeyboardButton(text=label, callback_data=f"lim_{val}"))
+        row.append(InlineKeyboardButton(text=label, callback_data=SetLimit(val).pack()))
         if len(row) == 4:
             buttons.append(row)
             row = []
     if row:
         buttons.append(row)
 
-    buttons.append([InlineKeyboardButton(text="◀️ Админ-панель", callback_data="admin")])
+    rolling = await quota.is_rolling()
+    buttons.append(quota_mode_button(rolling))
+    buttons.append([InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())])
 
+    window = "за скользящие 24 часа" if rolling else "в день"
     await callback.message.edit_text(
         f"⚙️ <b>Настройка лимита</b>\n\n"
         f"Сейчас каждый пользователь может получить\n"
-        f"<b>{current}</b> почт в день.\n\n"
+        f"<b>{current}</b> почт {window}.\n"
+        f"Персональные лимиты и тарифы задаются в профиле пользователя.\n\n"
         f"Выберите новое значение:",
         parse_mode="HTML",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
     )
 
 
-@router.callback_query(F.data.startswith("lim_"))
-async def set_limit(callback: CallbackQuery):
+@callback_table(SetLimit)
+async def set_limit(callback: CallbackQuery, callback_data: SetLimit):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
-    val = int(callback.data.split("_")[1])
+    val = callback_data.value
     old = await db.get_daily_limit()
     await db.set_daily_limit(val)
+    quota.invalidate()
 
     values = [1, 2, 3, 5, 10, 20, 50]
     buttons = []
     row = []
     for v in values:
         label = f"✅ {v}" if v == val else str(v)
-        row.append(InlineKeyboardButton(text=label, callback_data=f"lim_{v}"))
+        row.append(InlineKeyboardButton(text=label, callback_data=SetLimit(v).pack()))
         if len(row) == 4:
             buttons.append(row)
             row = []
     if row:
         buttons.append(row)
-    buttons.append([InlineKeyboardButton(text="◀️ Админ-панель", callback_data="admin")])
+    buttons.append(quota_mode_button(await quota.is_rolling()))
+    buttons.append([InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())])
 
     if old == val:
         await callback.answer(f"Лимит уже {val}")
@@ -566,9 +788,27 @@ async def set_limit(callback: CallbackQuery):
     )
 
 
+@callback_table(LimitMode)
+async def toggle_limit_mode(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    rolling = not await quota.is_rolling()
+    await db.set_quota_window("rolling" if rolling else "daily")
+    quota.invalidate()
+
+    if rolling:
+        await callback.answer("✅ Лимит считается за скользящие 24 часа")
+    else:
+        await callback.answer("✅ Лимит сбрасывается в полночь")
+
+    await limit_menu(callback)
+
+
 # ==================== ПОЛЬЗОВАТЕЛИ ====================
 
-@router.callback_query(F.data == "users")
+@callback_table(Users)
 async def users_list(callback: CallbackQuery):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
@@ -592,10 +832,10 @@ async def users_list(callback: CallbackQuery):
         name = f"@{u['username']}" if u['username'] else u['full_name'] or f"ID:{u['user_id']}"
         buttons.append([InlineKeyboardButton(
             text=f"👤 {name} — {u['cnt']} почт",
-            callback_data=f"usr_{u['user_id']}"
+            callback_data=UserProfile(u['user_id']).pack()
         )])
 
-    buttons.append([InlineKeyboardButton(text="◀️ Админ-панель", callback_data="admin")])
+    buttons.append([InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())])
 
     await callback.message.edit_text(
         text,
@@ -606,53 +846,58 @@ async def users_list(callback: CallbackQuery):
 
 # ==================== ПРОФИЛЬ ПОЛЬЗОВАТЕЛЯ ====================
 
-@router.callback_query(F.data.startswith("usr_"))
-async def user_profile(callback: CallbackQuery):
+@callback_table(UserProfile)
+async def user_profile(callback: CallbackQuery, callback_data: UserProfile):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
-    uid = int(callback.data.split("_")[1])
+    uid = callback_data.user_id
     info = await db.get_user_info(uid)
     if not info:
         await callback.answer("Пользователь не найден")
         return
 
     name = f"@{info['username']}" if info['username'] else info['full_name'] or f"ID:{uid}"
-    all_mails = await db.get_user_mails(uid)
+    total = await db.get_user_issued_total(uid)
     today_count = await db.get_user_today_count(uid)
     months = await db.get_user_active_months(uid)
+    limit = await quota.limit_for(uid)
+    limit_source = await user_limit_source(uid)
 
-    today = datetime.now().strftime("%Y-%m-%d")
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    today = (await db.now()).date()
+    yesterday = today - timedelta(days=1)
 
     text = (
         f"👤 <b>{name}</b>\n\n"
         f"🆔 ID: <code>{uid}</code>\n"
-        f"📧 Всего получено: <b>{len(all_mails)}</b>\n"
-        f"📅 Сегодня: <b>{today_count}</b>\n\n"
+        f"📧 Всего получено: <b>{total}</b>\n"
+        f"📅 Сегодня: <b>{today_count}</b>\n"
+        f"⚙️ Лимит: <b>{limit}</b> ({limit_source})\n\n"
         f"Выберите период:"
     )
 
     buttons = [
         [
-            InlineKeyboardButton(text="📅 Сегодня", callback_data=f"pd_{uid}_d_{today}"),
-            InlineKeyboardButton(text="📅 Вчера", callback_data=f"pd_{uid}_d_{yesterday}"),
+            InlineKeyboardButton(text="📅 Сегодня", callback_data=UserMails(uid, "d", today).pack()),
+            InlineKeyboardButton(text="📅 Вчера", callback_data=UserMails(uid, "d", yesterday).pack()),
         ],
-        [InlineKeyboardButton(text="📋 За всё время", callback_data=f"pd_{uid}_a")],
+        [InlineKeyboardButton(text="📋 За всё время", callback_data=UserMails(uid, "a").pack())],
     ]
 
     if months:
         month_row = []
         for m in months[:6]:
-            month_row.append(InlineKeyboardButton(text=f"📆 {m}", callback_data=f"pd_{uid}_m_{m}"))
+            month = date.fromisoformat(f"{m}-01")
+            month_row.append(InlineKeyboardButton(text=f"📆 {m}", callback_data=UserMails(uid, "m", month).pack()))
             if len(month_row) == 2:
                 buttons.append(month_row)
                 month_row = []
         if month_row:
             buttons.append(month_row)
 
-    buttons.append([InlineKeyboardButton(text="◀️ Пользователи", callback_data="users")])
+    buttons.append([InlineKeyboardButton(text="⚙️ Лимит пользователя", callback_data=UserLimit(uid).pack())])
+    buttons.append([InlineKeyboardButton(text="◀️ Пользователи", callback_data=Users().pack())])
 
     await callback.message.edit_text(
         text,
@@ -661,35 +906,165 @@ async def user_profile(callback: CallbackQuery):
     )
 
 
+# ==================== ЛИМИТ ПОЛЬЗОВАТЕЛЯ ====================
+
+async def user_limit_source(uid: int) -> str:
+    row = await db.get_user_quota(uid)
+    if row and row['daily_limit'] is not None:
+        return "персональный"
+    if row and row['tier_limit'] is not None:
+        return f"тариф {row['tier']}"
+    return "общий"
+
+
+async def user_limit_screen(callback: CallbackQuery, uid: int):
+    info = await db.get_user_info(uid)
+    if not info:
+        await callback.answer("Пользователь не найден")
+        return
+
+    name = f"@{info['username']}" if info['username'] else info['full_name'] or f"ID:{uid}"
+    row = await db.get_user_quota(uid)
+    personal = row['daily_limit'] if row else None
+    tier = row['tier'] if row else None
+    limit = await quota.limit_for(uid)
+
+    values = [1, 2, 3, 5, 10, 20, 50]
+    buttons = []
+    btn_row = []
+    for val in values:
+        label = f"✅ {val}" if val == personal else str(val)
+        btn_row.append(InlineKeyboardButton(text=label, callback_data=SetUserLimit(uid, val).pack()))
+        if len(btn_row) == 4:
+            buttons.append(btn_row)
+            btn_row = []
+    if btn_row:
+        buttons.append(btn_row)
+
+    tiers = await db.get_tiers()
+    for t in tiers:
+        label = f"✅ Тариф {t['name']} ({t['daily_limit']})" if t['name'] == tier else f"🏷 Тариф {t['name']} ({t['daily_limit']})"
+        buttons.append([InlineKeyboardButton(text=label, callback_data=SetUserTier(uid, t['name']).pack())])
+
+    buttons.append([InlineKeyboardButton(text="♻️ Сбросить к общему", callback_data=SetUserLimit(uid, None).pack())])
+    buttons.append([InlineKeyboardButton(text=f"◀️ {name}", callback_data=UserProfile(uid).pack())])
+
+    await callback.message.edit_text(
+        f"⚙️ <b>Лимит пользователя {name}</b>\n\n"
+        f"Сейчас: <b>{limit}</b> ({await user_limit_source(uid)})\n\n"
+        f"Персональный лимит важнее тарифа,\n"
+        f"тариф важнее общего лимита.\n"
+        f"Тарифы создаются командой <code>/tier имя лимит</code>.",
+        parse_mode="HTML",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+
+
+@callback_table(UserLimit)
+async def user_limit_menu(callback: CallbackQuery, callback_data: UserLimit):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    await user_limit_screen(callback, callback_data.user_id)
+
+
+@callback_table(SetUserLimit)
+async def set_user_limit(callback: CallbackQuery, callback_data: SetUserLimit):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    uid, val = callback_data.user_id, callback_data.value
+    if val is None:
+        await db.set_user_limit(uid, None)
+        await db.set_user_tier(uid, None)
+        await callback.answer("✅ Лимит сброшен к общему")
+    else:
+        await db.set_user_limit(uid, val)
+        await callback.answer(f"✅ Персональный лимит: {val}")
+    quota.invalidate(uid)
+
+    await user_limit_screen(callback, uid)
+
+
+@callback_table(SetUserTier)
+async def set_user_tier(callback: CallbackQuery, callback_data: SetUserTier):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔ Нет доступа", show_alert=True)
+        return
+
+    uid, tier = callback_data.user_id, callback_data.tier
+    # Тариф действует, только если нет персонального лимита
+    await db.set_user_limit(uid, None)
+    await db.set_user_tier(uid, tier)
+    quota.invalidate(uid)
+    await callback.answer(f"✅ Тариф: {tier}")
+
+    await user_limit_screen(callback, uid)
+
+
+@router.message(Command("tier"))
+async def cmd_tier(message: Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    args = (command.args or "").split()
+    if len(args) == 2 and re.fullmatch(r"[a-z0-9]{1,16}", args[0]):
+        name, value = args
+        if value == "-":
+            deleted = await db.delete_tier(name)
+            text = f"🗑 Тариф <b>{name}</b> удалён." if deleted else f"Тариф <b>{name}</b> не найден."
+        elif value.isdigit():
+            await db.set_tier(name, int(value))
+            text = f"✅ Тариф <b>{name}</b>: <b>{value}</b> почт"
+        else:
+            text = None
+        if text:
+            quota.invalidate()
+            await message.answer(text, parse_mode="HTML", reply_markup=back_admin_kb())
+            return
+
+    tiers = await db.get_tiers()
+    lines = "\n".join(f"🏷 <b>{t['name']}</b> — {t['daily_limit']} почт" for t in tiers) or "Тарифов пока нет."
+    await message.answer(
+        f"🏷 <b>Тарифы</b>\n\n"
+        f"{lines}\n\n"
+        f"<code>/tier имя лимит</code> — создать или изменить\n"
+        f"<code>/tier имя -</code> — удалить\n"
+        f"Имя: латиница в нижнем регистре и цифры, до 16 символов.",
+        parse_mode="HTML",
+        reply_markup=back_admin_kb()
+    )
+
+
 # ==================== ПОЧТЫ ПО ПЕРИОДУ ====================
 
-@router.callback_query(F.data.startswith("pd_"))
-async def period_mails(callback: CallbackQuery):
+@callback_table(UserMails)
+async def period_mails(callback: CallbackQuery, callback_data: UserMails):
     if callback.from_user.id != ADMIN_ID:
         await callback.answer("⛔ Нет доступа", show_alert=True)
         return
 
-    parts = callback.data.split("_")
-    uid = int(parts[1])
-    ptype = parts[2]
+    uid = callback_data.user_id
+    ptype = callback_data.period
 
     info = await db.get_user_info(uid)
     name = f"@{info['username']}" if info['username'] else info['full_name'] or f"ID:{uid}"
 
-    if ptype == "d":
-        date_str = parts[3]
-        rows = await db.get_user_mails_by_date(uid, date_str)
-        today = datetime.now().strftime("%Y-%m-%d")
-        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-        if date_str == today:
+    if ptype == "d" and callback_data.day:
+        day = callback_data.day
+        rows = await db.get_user_mails_by_date(uid, day.isoformat())
+        today = (await db.now()).date()
+        if day == today:
             period = "сегодня"
-        elif date_str == yesterday:
+        elif day == today - timedelta(days=1):
             period = "вчера"
         else:
-            period = date_str
+            period = day.isoformat()
         title = f"📅 Почты за {period}"
-    elif ptype == "m":
-        month = parts[3]
+    elif ptype == "m" and callback_data.day:
+        month = callback_data.day.strftime("%Y-%m")
         rows = await db.get_user_mails_by_month(uid, month)
         title = f"📆 Почты за {month}"
     elif ptype == "a":
@@ -714,8 +1089,8 @@ async def period_mails(callback: CallbackQuery):
     text = text[:4000]
 
     buttons = [
-        [InlineKeyboardButton(text=f"◀️ {name}", callback_data=f"usr_{uid}")],
-        [InlineKeyboardButton(text="◀️ Пользователи", callback_data="users")],
+        [InlineKeyboardButton(text=f"◀️ {name}", callback_data=UserProfile(uid).pack())],
+        [InlineKeyboardButton(text="◀️ Пользователи", callback_data=Users().pack())],
     ]
 
     await callback.message.edit_text(
@@ -727,12 +1102,35 @@ async def period_mails(callback: CallbackQuery):
 
 # ==================== ЗАПУСК ====================
 
+@dp.update.outer_middleware()
+async def cold_start_timer(handler, event, data):
+    global first_update_pending
+    if not first_update_pending:
+        return await handler(event, data)
+    first_update_pending = False
+    try:
+        return await handler(event, data)
+    finally:
+        logger.info(
+            "Холодный старт: %.0f мс до первого обработанного апдейта",
+            (time.perf_counter() - STARTED_AT) * 1000
+        )
+
+
 async def main():
+    t0 = time.perf_counter()
     await db.connect()
-    logger.info("БД подключена, бот запускается...")
+    logger.info(
+        "БД подключена за %.0f мс (%.0f мс с запуска), бот запускается...",
+        (time.perf_counter() - t0) * 1000, (time.perf_counter() - STARTED_AT) * 1000
+    )
+    importer.start()
+    broadcaster.start()
     try:
         await dp.start_polling(bot)
     finally:
+        await broadcaster.stop()
+        await importer.stop()
         await db.close()
 
 
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import AdminPanel, BroadcastStop
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Telegram допускает около 30 сообщений в секунду на бота — оставляем запас
+MESSAGES_PER_SECOND = 25
+CONCURRENCY = 10
+PAGE_SIZE = 200
+STATUS_INTERVAL = 3.0
+
+
+class RateLimiter:
+    """Равномерно раздаёт слоты отправки на всех отправителей."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(self._next, now) + self.interval
+
+    def pause(self, seconds: float):
+        """После 429 придерживаем всех отправителей, а не только получившего ошибку."""
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+class BroadcastWorker:
+    """Рассылка сообщения всем пользователям из users.
+
+    Получатели читаются страницами по user_id (keyset) и отправляются
+    пачками по CONCURRENCY под общим лимитом MESSAGES_PER_SECOND. После
+    каждой пачки прогресс сохраняется в broadcasts.last_user_id, так что
+    после перезапуска рассылка продолжается со следующей пачки. Доставка
+    «хотя бы один раз»: пачку, прерванную перезапуском, получат повторно —
+    не больше CONCURRENCY сообщений.
+    Заблокировавшие бота пользователи помечаются в users.blocked_at.
+    """
+
+    def __init__(self, bot: Bot, db: Database):
+        self.bot = bot
+        self.db = db
+        self.limiter = RateLimiter(MESSAGES_PER_SECOND)
+        self._wake = asyncio.Event()
+        self._cancelled: set[int] = set()
+        self._current: int | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        self._wake.set()
+
+    def cancel(self, broadcast_id: int):
+        # Рассылку из очереди claim_broadcast и так пропустит по статусу
+        if broadcast_id == self._current:
+            self._cancelled.add(broadcast_id)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                job = await self.db.claim_broadcast()
+            except Exception:
+                logger.exception("Не удалось взять рассылку")
+                await asyncio.sleep(5)
+                continue
+            if job is None:
+                await self._wake.wait()
+                continue
+            self._current = job['id']
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Рассылка #%s упала", job['id'])
+                try:
+                    await self.db.finish_broadcast(job['id'], "failed")
+                except Exception:
+                    # Рассылка остаётся running и продолжится с контрольной точки
+                    logger.exception("Не удалось завершить рассылку #%s", job['id'])
+                    await asyncio.sleep(5)
+                    continue
+                await self._status(job, f"❌ <b>Рассылка #{job['id']} прервана ошибкой</b>", final=True)
+            finally:
+                self._current = None
+                self._cancelled.discard(job['id'])
+
+    async def _status(self, job, text: str, final: bool = False):
+        if not job['message_id']:
+            return
+        buttons = []
+        if not final:
+            buttons.append([InlineKeyboardButton(text="⏹ Остановить", callback_data=BroadcastStop(job['id']).pack())])
+        buttons.append([InlineKeyboardButton(text="◀️ Админ-панель", callback_data=AdminPanel().pack())])
+        try:
+            await self.bot.edit_message_text(
+                text,
+                chat_id=job['chat_id'],
+                message_id=job['message_id'],
+                parse_mode="HTML",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
+            )
+        except Exception:
+            pass
+
+    async def _send(self, user_id: int, text: str) -> str:
+        """Возвращает 'sent', 'blocked' или 'failed'."""
+        for _ in range(3):
+            await self.limiter.wait()
+            try:
+                await self.bot.send_message(user_id, text, parse_mode="HTML")
+                return "sent"
+            except TelegramRetryAfter as e:
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return "blocked"
+                return "failed"
+            except Exception:
+                logger.exception("Рассылка: не удалось отправить %s", user_id)
+                return "failed"
+        return "failed"
+
+    async def _process(self, job):
+        job_id = job['id']
+        counts = {"sent": job['sent'], "failed": job['failed'], "blocked": job['blocked']}
+        done_before = sum(counts.values())
+        last_user_id = job['last_user_id']
+        started = time.monotonic()
+        last_status = 0.0
+
+        async def deliver(user_id: int):
+            return user_id, await self._send(user_id, job['text'])
+
+        while job_id not in self._cancelled:
+            recipients = await self.db.get_broadcast_recipients(last_user_id, PAGE_SIZE)
+            if not recipients:
+                break
+
+            for start in range(0, len(recipients), CONCURRENCY):
+                if job_id in self._cancelled:
+                    break
+                batch = recipients[start:start + CONCURRENCY]
+                results = await asyncio.gather(*(deliver(uid) for uid in batch))
+                blocked = [uid for uid, result in results if result == "blocked"]
+                for _, result in results:
+                    counts[result] += 1
+                if blocked:
+                    await self.db.mark_users_blocked(blocked)
+
+                last_user_id = batch[-1]
+                await self.db.checkpoint_broadcast(job_id, last_user_id, **counts)
+
+                if time.monotonic() - last_status >= STATUS_INTERVAL:
+                    last_status = time.monotonic()
+                    done = sum(counts.values())
+                    rate = (done - done_before) / max(time.monotonic() - started, 1e-6)
+                    left = max(job['total'] - done, 0)
+                    eta = f"{int(left / rate // 60)} мин {int(left / rate % 60)} с" if rate > 0 else "—"
+                    await self._status(
+                        job,
+                        f"📢 <b>Рассылка #{job_id}</b>\n\n"
+                        f"Обработано: <b>{done}</b> из <b>{job['total']}</b>\n"
+                        f"✅ Доставлено: <b>{counts['sent']}</b>\n"
+                        f"🚫 Заблокировали бота: <b>{counts['blocked']}</b>\n"
+                        f"❌ Ошибок: <b>{counts['failed']}</b>\n\n"
+                        f"⚡ Скорость: <b>{rate:.1f}</b> сообщ./с\n"
+                        f"⏱ Осталось: ~{eta}"
+                    )
+
+        cancelled = job_id in self._cancelled
+        if not cancelled:
+            await self.db.finish_broadcast(job_id, "done")
+
+        elapsed = time.monotonic() - started
+        rate = (sum(counts.values()) - done_before) / max(elapsed, 1e-6)
+        title = "⏹ Рассылка остановлена" if cancelled else "✅ Рассылка завершена"
+        await self._status(
+            job,
+            f"{title} <b>#{job_id}</b>\n\n"
+            f"✅ Доставлено: <b>{counts['sent']}</b>\n"
+            f"🚫 Заблокировали бота: <b>{counts['blocked']}</b>\n"
+            f"❌ Ошибок: <b>{counts['failed']}</b>\n\n"
+            f"⏱ Время: {int(elapsed // 60)} мин {int(elapsed % 60)} с, {rate:.1f} сообщ./с",
+            final=True
+        )
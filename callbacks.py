@@ -0,0 +1,290 @@
+import inspect
+from dataclasses import dataclass, fields
+from datetime import date
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, ClassVar, get_args, get_type_hints
+
+# Только для аннотаций: кодеки Payload проверяются в loadtest без aiogram
+if TYPE_CHECKING:
+    from aiogram.types import CallbackQuery
+
+SEP = ":"
+# Лимит Telegram на callback_data, байт
+MAX_LENGTH = 64
+# Даты кодируются числом дней от EPOCH
+EPOCH = date(2020, 1, 1)
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to_base36(value: int) -> str:
+    if value < 0:
+        return "-" + to_base36(-value)
+    out = ""
+    while True:
+        value, digit = divmod(value, 36)
+        out = DIGITS[digit] + out
+        if not value:
+            return out
+
+
+def encode_str(value: str) -> str:
+    if SEP in value:
+        raise ValueError(f"{SEP!r} в строковом поле callback_data: {value!r}")
+    return value
+
+
+CODECS: dict[type, tuple[Callable[[Any], str], Callable[[str], Any]]] = {
+    int: (to_base36, lambda s: int(s, 36)),
+    str: (encode_str, str),
+    bool: (lambda v: "1" if v else "", bool),
+    date: (lambda v: to_base36((v - EPOCH).days), lambda s: date.fromordinal(EPOCH.toordinal() + int(s, 36))),
+}
+
+
+def optional(codec):
+    encode, decode = codec
+    return (lambda v: "" if v is None else encode(v)), (lambda s: decode(s) if s else None)
+
+
+class Payload:
+    """Типизированные данные инлайн-кнопки.
+
+    Подклассы объявляются через @payload(prefix) как обычные dataclass с
+    полями int, str, bool, date (или X | None). pack() собирает строку
+    prefix:поле:поле — числа в base36, даты днями от EPOCH, — так что
+    pd_<uid>_d_<YYYY-MM-DD> превращается в um:<7 символов>:d:<3 символа>.
+    """
+
+    prefix: ClassVar[str]
+    codecs: ClassVar[tuple[tuple[str, Callable, Callable], ...]]
+
+    def pack(self) -> str:
+        data = SEP.join([self.prefix, *(encode(getattr(self, name)) for name, encode, _ in self.codecs)])
+        if len(data.encode()) > MAX_LENGTH:
+            raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data!r}")
+        return data
+
+    @classmethod
+    def unpack(cls, values: list[str]) -> "Payload":
+        if len(values) != len(cls.codecs):
+            raise ValueError(f"{cls.__name__}: ожидалось {len(cls.codecs)} полей, пришло {len(values)}")
+        return cls(*(decode(value) for (_, _, decode), value in zip(cls.codecs, values)))
+
+
+PAYLOADS: dict[str, type[Payload]] = {}
+# callback_data кнопок, отправленных до перехода на Payload: старые меню
+# в чатах пользователей продолжают работать
+LEGACY: dict[str, type[Payload]] = {}
+
+
+def payload(prefix: str, legacy: str | None = None):
+    def register(cls: type[Payload]) -> type[Payload]:
+        if not prefix or SEP in prefix or prefix in PAYLOADS or prefix in LEGACY:
+            raise ValueError(f"Некорректный или занятый префикс callback_data: {prefix!r}")
+        if legacy is not None and (legacy in PAYLOADS or legacy in LEGACY):
+            raise ValueError(f"Старое callback_data совпадает с префиксом: {legacy!r}")
+        cls = dataclass(frozen=True)(cls)
+        hints = get_type_hints(cls)
+        codecs = []
+        for field in fields(cls):
+            hint = hints[field.name]
+            args = get_args(hint)
+            if type(None) in args:
+                inner, = (a for a in args if a is not type(None))
+                encode, decode = optional(CODECS[inner])
+            else:
+                encode, decode = CODECS[hint]
+            codecs.append((field.name, encode, decode))
+        cls.prefix = prefix
+        cls.codecs = tuple(codecs)
+        if legacy is not None:
+            if codecs:
+                raise ValueError(f"{cls.__name__}: старое callback_data только для кнопок без полей")
+            LEGACY[legacy] = cls
+        PAYLOADS[prefix] = cls
+        return cls
+    return register
+
+
+def unpack(data: str) -> Payload | None:
+    """Разбирает callback_data; None для устаревших и чужих кнопок."""
+    if data in LEGACY:
+        return LEGACY[data]()
+    prefix, *values = data.split(SEP)
+    cls = PAYLOADS.get(prefix)
+    if cls is None:
+        return None
+    try:
+        return cls.unpack(values)
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+class CallbackTable:
+    """Диспетчеризация нажатий по префиксу callback_data.
+
+    Вместо цепочки F.data == ... / F.data.startswith(...), которую aiogram
+    проверяет по порядку на каждом нажатии, на роутере висит один хендлер:
+    префикс ищется в словаре, данные разбираются в Payload и передаются
+    хендлеру аргументом callback_data. Остальные аргументы хендлера (state
+    и т.п.) берутся из данных aiogram по имени, как у обычных хендлеров.
+    Старые callback_data без параметров (LEGACY) проверяются раньше префикса.
+    """
+
+    def __init__(self):
+        self._handlers: dict[str, tuple[type[Payload], Callable[..., Awaitable[Any]], tuple[str, ...]]] = {}
+
+    def __call__(self, cls: type[Payload]):
+        def register(handler: Callable[..., Awaitable[Any]]):
+            if cls.prefix in self._handlers:
+                raise ValueError(f"Хендлер для {cls.__name__} уже зарегистрирован")
+            params = tuple(inspect.signature(handler).parameters)[1:]
+            self._handlers[cls.prefix] = (cls, handler, params)
+            return handler
+        return register
+
+    async def dispatch(self, callback: "CallbackQuery", **data: Any) -> Any:
+        raw = callback.data or ""
+        legacy = LEGACY.get(raw)
+        if legacy is not None:
+            prefix, values = legacy.prefix, []
+        else:
+            prefix, *values = raw.split(SEP)
+        entry = self._handlers.get(prefix)
+        try:
+            callback_data = entry[0].unpack(values) if entry else None
+        except (ValueError, TypeError, OverflowError):
+            callback_data = None
+        if callback_data is None:
+            await callback.answer("⌛ Кнопка устарела, откройте меню заново")
+            return None
+
+        _, handler, params = entry
+        data["callback_data"] = callback_data
+        return await handler(callback, **{name: data[name] for name in params if name in data})
+
+
+# ==================== КНОПКИ ====================
+
+@payload("h", legacy="home")
+class Home(Payload): ...
+
+
+@payload("g", legacy="get_mail")
+class GetMail(Payload): ...
+
+
+@payload("m", legacy="my_mails")
+class MyMails(Payload): ...
+
+
+@payload("a", legacy="admin")
+class AdminPanel(Payload): ...
+
+
+@payload("u", legacy="upload")
+class Upload(Payload): ...
+
+
+@payload("mm", legacy="manage_mails")
+class ManageMails(Payload): ...
+
+
+@payload("du", legacy="del_unused")
+class DeleteUnused(Payload): ...
+
+
+@payload("duc", legacy="confirm_del_unused")
+class ConfirmDeleteUnused(Payload): ...
+
+
+@payload("dd", legacy="del_used")
+class DeleteUsed(Payload): ...
+
+
+@payload("ddc", legacy="confirm_del_used")
+class ConfirmDeleteUsed(Payload): ...
+
+
+@payload("da", legacy="del_all")
+class DeleteAll(Payload): ...
+
+
+@payload("dac", legacy="confirm_del_all")
+class ConfirmDeleteAll(Payload): ...
+
+
+@payload("s", legacy="stats")
+class Stats(Payload): ...
+
+
+@payload("t")
+class Trend(Payload): ...
+
+
+@payload("b")
+class Broadcast(Payload): ...
+
+
+@payload("br")
+class BroadcastRestock(Payload): ...
+
+
+@payload("bs")
+class BroadcastSend(Payload): ...
+
+
+@payload("bc")
+class BroadcastCancel(Payload): ...
+
+
+@payload("bx")
+class BroadcastStop(Payload):
+    broadcast_id: int
+
+
+@payload("l", legacy="limit")
+class LimitMenu(Payload): ...
+
+
+@payload("ls")
+class SetLimit(Payload):
+    value: int
+
+
+@payload("lm")
+class LimitMode(Payload): ...
+
+
+@payload("us", legacy="users")
+class Users(Payload): ...
+
+
+@payload("up")
+class UserProfile(Payload):
+    user_id: int
+
+
+@payload("um")
+class UserMails(Payload):
+    """period: d — за день day, m — за месяц day (первое число), a — за всё время."""
+    user_id: int
+    period: str
+    day: date | None = None
+
+
+@payload("ul")
+class UserLimit(Payload):
+    user_id: int
+
+
+@payload("ulv")
+class SetUserLimit(Payload):
+    """value None — сбросить персональный лимит и тариф."""
+    user_id: int
+    value: int | None
+
+
+@payload("ut")
+class SetUserTier(Payload):
+    user_id: int
+    tier: str
@@ -1,10 +1,301 @@
+import asyncio
 import asyncpg
+import logging
 import os
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator
 
+from migrations import migrate
 
-class Database:
+logger = logging.getLogger(__name__)
+
+# Как часто перепроверять расхождение часов процесса и БД, секунд
+CLOCK_REFRESH = 600
+
+# Как часто измерять отставание реплики и сколько ждать соединения с ней, секунд
+REPLICA_CHECK_INTERVAL = 1.0
+REPLICA_TIMEOUT = 2.0
+# Отставание реплики в секундах: 0, если всё принятое WAL применено, иначе возраст
+# последней применённой транзакции; NULL, если реплика не получает WAL от primary
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8
+    END
+"""
+# Сбои реплики, после которых чтение повторяется на primary
+REPLICA_ERRORS = (
+    OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    # Запрос отменён из-за конфликта с применением WAL
+    asyncpg.SerializationError,
+)
+
+
+def split_mail(line: str) -> tuple[str, str]:
+    """'Email@Example.com:pass' -> ('Email@Example.com', 'pass').
+
+    Email хранится как загружен; дубликаты сравниваются по lower(email).
+    """
+    email, _, password = line.partition(":")
+    return email, password
+
+
+class Database(ABC):
+    """Интерфейс хранилища бота.
+
+    Реализации: PostgresDatabase (asyncpg, DATABASE_URL=postgres://...) и
+    SQLiteDatabase (встроенная база в одном файле, DATABASE_URL=sqlite:///path).
+    Строки результатов поддерживают доступ row['column'].
+    """
+
+    @abstractmethod
+    async def connect(self):
+        ...
+
+    # ---- Users ----
+
+    @abstractmethod
+    async def add_user(self, user_id: int, username: str, full_name: str):
+        ...
+
+    @abstractmethod
+    async def get_user_info(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def count_users(self) -> int:
+        ...
+
+    @abstractmethod
+    async def get_active_users(self):
+        ...
+
+    # ---- Mails ----
+
+    @abstractmethod
+    async def add_mails_bulk(self, mails: list[str]) -> tuple[int, int]:
+        """Добавляет строки email:password. Возвращает (добавлено, уже были в базе)."""
+
+    @abstractmethod
+    def iter_emails(self) -> AsyncIterator[str]:
+        """Все email, кроме повторов в истории выдач, — для фильтра дубликатов."""
+
+    @abstractmethod
+    async def take_mail(self, user_id: int) -> tuple[str, datetime] | None:
+        """Атомарно выдаёт первую свободную почту.
+
+        В той же транзакции обновляет счётчики выдач и дописывает время выдачи
+        в quota_buckets. Возвращает (email:password, used_at) или None.
+        """
+
+    @abstractmethod
+    async def count_available_mails(self) -> int:
+        ...
+
+    @abstractmethod
+    async def count_used_mails(self) -> int:
+        ...
+
+    @abstractmethod
+    async def count_mails(self) -> tuple[int, int]:
+        """(свободных, выданных) одним запросом — для сумм в админке."""
+
+    @abstractmethod
+    async def count_today_given(self) -> int:
+        ...
+
+    @abstractmethod
+    async def count_issued_total(self) -> int:
+        ...
+
+    @abstractmethod
+    async def count_issuing_users(self) -> int:
+        ...
+
+    @abstractmethod
+    async def get_daily_issuance(self, days: int):
+        ...
+
+    @abstractmethod
+    async def delete_unused_mails(self) -> int:
+        ...
+
+    @abstractmethod
+    async def delete_used_mails(self) -> int:
+        ...
+
+    @abstractmethod
+    async def delete_all_mails(self) -> int:
+        ...
+
+    @abstractmethod
+    async def get_user_today_count(self, user_id: int) -> int:
+        ...
+
+    @abstractmethod
+    async def get_user_issued_total(self, user_id: int) -> int:
+        ...
+
+    @abstractmethod
+    async def get_user_mails(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def get_user_mails_by_date(self, user_id: int, date: str):
+        ...
+
+    @abstractmethod
+    async def get_user_mails_by_month(self, user_id: int, month: str):
+        ...
+
+    @abstractmethod
+    async def get_user_active_months(self, user_id: int):
+        ...
+
+    # ---- Import jobs ----
+
+    @abstractmethod
+    async def create_import_job(self, file_id: str, file_unique_id: str, file_name: str,
+                                chat_id: int, message_id: int) -> tuple[int, bool]:
+        """Ставит файл в очередь. Если он уже в очереди — возвращает (id, False)."""
+
+    @abstractmethod
+    async def claim_import_job(self):
+        """Следующая задача загрузки; начатая до перезапуска продолжается первой."""
+
+    @abstractmethod
+    async def count_queued_imports(self, before_id: int) -> int:
+        ...
+
+    @abstractmethod
+    async def start_import_job(self, job_id: int, total: int, in_file: int):
+        ...
+
+    @abstractmethod
+    async def import_batch(self, job_id: int, mails: list[str], position: int, known: int) -> tuple[int, int]:
+        """Вставляет пачку и сдвигает position задачи в одной транзакции."""
+
+    @abstractmethod
+    async def finish_import_job(self, job_id: int, status: str, error: str | None = None):
+        ...
+
+    # ---- Broadcasts ----
+
+    @abstractmethod
+    async def count_reachable_users(self) -> int:
+        ...
+
+    @abstractmethod
+    async def get_broadcast_recipients(self, after_user_id: int, limit: int) -> list[int]:
+        ...
+
+    @abstractmethod
+    async def mark_users_blocked(self, user_ids: list[int]):
+        ...
+
+    @abstractmethod
+    async def create_broadcast(self, text: str, chat_id: int, message_id: int, total: int) -> int:
+        ...
+
+    @abstractmethod
+    async def claim_broadcast(self):
+        """Следующая рассылка; прерванная перезапуском продолжается первой."""
+
+    @abstractmethod
+    async def checkpoint_broadcast(self, broadcast_id: int, last_user_id: int, sent: int,
+                                   failed: int, blocked: int):
+        ...
+
+    @abstractmethod
+    async def finish_broadcast(self, broadcast_id: int, status: str) -> bool:
+        ...
+
+    # ---- Quotas ----
+
+    @abstractmethod
+    async def now(self) -> datetime:
+        """Время по часам БД: в них записаны used_at и корзины квот и от них
+        считаются сутки в счётчиках выдач."""
+
+    @abstractmethod
+    async def get_quota_bucket(self, user_id: int) -> list[datetime]:
+        ...
+
+    @abstractmethod
+    async def get_user_quota(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def set_user_limit(self, user_id: int, limit: int | None):
+        ...
+
+    @abstractmethod
+    async def set_user_tier(self, user_id: int, tier: str | None):
+        ...
+
+    @abstractmethod
+    async def get_tiers(self):
+        ...
+
+    @abstractmethod
+    async def set_tier(self, name: str, limit: int):
+        ...
+
+    @abstractmethod
+    async def delete_tier(self, name: str) -> bool:
+        ...
+
+    # ---- Settings ----
+
+    @abstractmethod
+    async def get_daily_limit(self) -> int:
+        ...
+
+    @abstractmethod
+    async def set_daily_limit(self, limit: int):
+        ...
+
+    @abstractmethod
+    async def get_quota_window(self) -> str:
+        ...
+
+    @abstractmethod
+    async def set_quota_window(self, mode: str):
+        ...
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+
+def open_database() -> Database:
+    """Выбирает хранилище по DATABASE_URL: sqlite:///path или Postgres DSN."""
+    url = os.getenv("DATABASE_URL", "")
+    if url.startswith("sqlite:"):
+        from sqlite_database import SQLiteDatabase
+        path = url.split(":", 1)[1].removeprefix("//").removeprefix("/")
+        return SQLiteDatabase(path or "data/bot.db")
+    return PostgresDatabase()
+
+
+class PostgresDatabase(Database):
     def __init__(self):
         self.pool: asyncpg.Pool | None = None
+        # Реплика для тяжёлых чтений админки и истории; без неё всё идёт в primary
+        self.replica: asyncpg.Pool | None = None
+        self.replica_max_lag = float(os.getenv("REPLICA_MAX_LAG", "5"))
+        self._replica_dsn: str | None = None
+        # Последнее измеренное отставание реплики; None — недоступна или не измерено
+        self._replica_lag: float | None = None
+        self._replica_monitor: asyncio.Task | None = None
+        self._user_writes: dict[int, float] = {}
+        self._bulk_write = 0.0
+        self._clock_skew = None
+        self._clock_checked = 0.0
 
     async def connect(self):
         self.pool = await asyncpg.create_pool(
@@ -12,44 +303,82 @@ class Database:
             min_size=2,
             max_size=10
         )
+        # Недоступная реплика не мешает запуску: монитор подключится к ней позже
+        self._replica_dsn = os.getenv("DATABASE_REPLICA_URL")
+        if self._replica_dsn:
+            await self._probe_replica()
+            self._replica_monitor = asyncio.create_task(self._monitor_replica())
         await self.init()
 
-    async def init(self):
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    username TEXT DEFAULT '',
-                    full_name TEXT DEFAULT '',
-                    created_at TIMESTAMP DEFAULT NOW()
+    async def _probe_replica(self):
+        try:
+            if self.replica is None:
+                self.replica = await asyncpg.create_pool(
+                    dsn=self._replica_dsn,
+                    min_size=1,
+                    max_size=5,
+                    timeout=REPLICA_TIMEOUT
                 )
-            """)
+            async with self.replica.acquire(timeout=REPLICA_TIMEOUT) as conn:
+                lag = await conn.fetchval(REPLICA_LAG_QUERY, timeout=REPLICA_TIMEOUT)
+        except Exception as e:
+            lag = None
+            if self._replica_lag is not None:
+                logger.warning("Реплика недоступна, чтения идут в primary: %r", e)
+        if lag is not None and self._replica_lag is None:
+            logger.info("Реплика на связи, отставание %.1f с", lag)
+        self._replica_lag = lag
 
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS mails (
-                    id SERIAL PRIMARY KEY,
-                    mail TEXT UNIQUE NOT NULL,
-                    is_used BOOLEAN DEFAULT FALSE,
-                    used_by BIGINT REFERENCES users(user_id),
-                    used_at TIMESTAMP
-                )
-            """)
+    async def _monitor_replica(self):
+        while True:
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+            await self._probe_replica()
 
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )
-            """)
+    def _reader(self, user_id: int | None = None) -> asyncpg.Pool:
+        """Пул для чтения: реплика, если она на связи, её измеренное отставание
+        (pg_last_xact_replay_timestamp) не больше REPLICA_MAX_LAG и она не может
+        не видеть недавней записи этого процесса."""
+        lag = self._replica_lag
+        if self.replica is None or lag is None or lag > self.replica_max_lag:
+            return self.pool
+        # Отставание могло вырасти с последнего замера
+        window = self.replica_max_lag + REPLICA_CHECK_INTERVAL
+        now = time.monotonic()
+        if now - self._bulk_write < window:
+            return self.pool
+        if user_id is not None and now - self._user_writes.get(user_id, 0.0) < window:
+            return self.pool
+        return self.replica
 
-            await conn.execute("""
-                INSERT INTO settings (key, value) VALUES ('daily_limit', '3')
-                ON CONFLICT (key) DO NOTHING
-            """)
+    async def _read(self, user_id: int | None, method: str, query: str, *args):
+        """conn.<method>(query, *args) на пуле _reader(); при сбое реплики — на primary."""
+        pool = self._reader(user_id)
+        if pool is not self.pool:
+            try:
+                async with pool.acquire(timeout=REPLICA_TIMEOUT) as conn:
+                    return await getattr(conn, method)(query, *args)
+            except REPLICA_ERRORS as e:
+                # До следующего удачного замера монитора реплика не используется
+                logger.warning("Чтение с реплики не удалось, повтор в primary: %r", e)
+                self._replica_lag = None
+        async with self.pool.acquire() as conn:
+            return await getattr(conn, method)(query, *args)
 
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_mails_is_used ON mails(is_used)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_mails_used_by ON mails(used_by)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_mails_used_at ON mails(used_at)")
+    def _wrote(self, user_id: int | None = None):
+        now = time.monotonic()
+        if user_id is None:
+            self._bulk_write = now
+        else:
+            self._user_writes[user_id] = now
+            # Старые отметки больше ни на что не влияют
+            if len(self._user_writes) > 10000:
+                self._user_writes = {
+                    uid: ts for uid, ts in self._user_writes.items()
+                    if now - ts < self.replica_max_lag + REPLICA_CHECK_INTERVAL
+                }
+
+    async def init(self):
+        await migrate(self.pool)
 
     # ---- Users ----
 
@@ -58,121 +387,361 @@ class Database:
             await conn.execute("""
                 INSERT INTO users (user_id, username, full_name)
                 VALUES ($1, $2, $3)
-                ON CONFLICT (user_id) DO UPDATE SET username=$2, full_name=$3
+                ON CONFLICT (user_id) DO UPDATE SET username=$2, full_name=$3, blocked_at=NULL
             """, user_id, username, full_name)
+        self._wrote(user_id)
 
     async def get_user_info(self, user_id: int):
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT user_id, username, full_name FROM users WHERE user_id=$1", user_id
-            )
+        return await self._read(
+            user_id, "fetchrow",
+            "SELECT user_id, username, full_name FROM users WHERE user_id=$1", user_id
+        )
 
     async def count_users(self) -> int:
-        async with self.pool.acquire() as conn:
-            return await conn.fetchval("SELECT COUNT(*) FROM users")
+        return await self._read(None, "fetchval", "SELECT COUNT(*) FROM users")
 
     async def get_active_users(self):
-        async with self.pool.acquire() as conn:
-            return await conn.fetch("""
-                SELECT u.user_id, u.username, u.full_name, COUNT(m.id) as cnt
-                FROM users u
-                JOIN mails m ON m.used_by = u.user_id
-                WHERE m.is_used = TRUE
-                GROUP BY u.user_id, u.username, u.full_name
-                ORDER BY cnt DESC
-            """)
+        return await self._read(None, "fetch", """
+            SELECT u.user_id, u.username, u.full_name, r.cnt
+            FROM (
+                SELECT user_id, SUM(issued) AS cnt FROM issuance_user_daily GROUP BY user_id
+            ) r
+            JOIN users u ON u.user_id = r.user_id
+            ORDER BY r.cnt DESC
+        """)
 
     # ---- Mails ----
 
+    async def _insert_mails(self, conn: asyncpg.Connection, mails: list[str]) -> tuple[int, int]:
+        emails, passwords = zip(*(split_mail(mail) for mail in mails)) if mails else ((), ())
+        rows = await conn.fetch("""
+            INSERT INTO mails (email, password)
+            SELECT * FROM unnest($1::text[], $2::text[])
+            ON CONFLICT ((md5(lower(email))::uuid)) WHERE NOT is_repeat DO NOTHING
+            RETURNING id
+        """, list(emails), list(passwords))
+        added = len(rows)
+        return added, len(mails) - added
+
     async def add_mails_bulk(self, mails: list[str]) -> tuple[int, int]:
-        added = 0
-        duplicates = 0
+        async with self.pool.acquire() as conn:
+            result = await self._insert_mails(conn, mails)
+        self._wrote()
+        return result
+
+    async def iter_emails(self, prefetch: int = 10000):
         async with self.pool.acquire() as conn:
             async with conn.transaction():
-                for mail in mails:
-                    try:
-                        await conn.execute("INSERT INTO mails (mail) VALUES ($1)", mail)
-                        added += 1
-                    except asyncpg.UniqueViolationError:
-                        duplicates += 1
-        return added, duplicates
+                query = "SELECT email FROM mails WHERE NOT is_repeat"
+                async for record in conn.cursor(query, prefetch=prefetch):
+                    yield record['email']
 
-    async def take_mail(self, user_id: int) -> str | None:
+    async def take_mail(self, user_id: int) -> tuple[str, datetime] | None:
         async with self.pool.acquire() as conn:
+            # Выдача, счётчики issuance_* и корзина квоты обновляются одним запросом;
+            # из корзины сразу выпадают выдачи старше 24 часов
             row = await conn.fetchrow("""
-                UPDATE mails SET is_used = TRUE, used_by = $1, used_at = NOW()
-                WHERE id = (
-                    SELECT id FROM mails WHERE is_used = FALSE ORDER BY id LIMIT 1
-                    FOR UPDATE SKIP LOCKED
+                WITH taken AS (
+                    UPDATE mails SET is_used = TRUE, used_by = $1, used_at = NOW()
+                    WHERE id = (
+                        SELECT id FROM mails WHERE is_used = FALSE ORDER BY id LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING email, password, used_at
+                ), per_day AS (
+                    INSERT INTO issuance_daily (day, issued)
+                    SELECT used_at::date, 1 FROM taken
+                    ON CONFLICT (day) DO UPDATE SET issued = issuance_daily.issued + 1
+                ), per_user AS (
+                    INSERT INTO issuance_user_daily (user_id, day, issued)
+                    SELECT $1, used_at::date, 1 FROM taken
+                    ON CONFLICT (user_id, day) DO UPDATE SET issued = issuance_user_daily.issued + 1
+                ), bucket AS (
+                    INSERT INTO quota_buckets (user_id, grants)
+                    SELECT $1, ARRAY[used_at] FROM taken
+                    ON CONFLICT (user_id) DO UPDATE SET grants = ARRAY(
+                        SELECT g FROM unnest(quota_buckets.grants) AS g
+                        WHERE g > EXCLUDED.grants[1] - INTERVAL '24 hours'
+                        ORDER BY g
+                    ) || EXCLUDED.grants
                 )
-                RETURNING mail
+                SELECT email || ':' || password AS mail, used_at FROM taken
             """, user_id)
-            return row['mail'] if row else None
+            if row is None:
+                return None
+            self._wrote(user_id)
+            return row['mail'], row['used_at']
 
     async def count_available_mails(self) -> int:
         async with self.pool.acquire() as conn:
             return await conn.fetchval("SELECT COUNT(*) FROM mails WHERE is_used = FALSE")
 
     async def count_used_mails(self) -> int:
-        async with self.pool.acquire() as conn:
-            return await conn.fetchval("SELECT COUNT(*) FROM mails WHERE is_used = TRUE")
+        return await self._read(None, "fetchval", "SELECT COUNT(*) FROM mails WHERE is_used = TRUE")
 
-    async def count_today_given(self) -> int:
+    async def count_mails(self) -> tuple[int, int]:
+        # Свободные читаются с primary, поэтому и сумма — с него
         async with self.pool.acquire() as conn:
-            return await conn.fetchval(
-                "SELECT COUNT(*) FROM mails WHERE is_used = TRUE AND used_at::date = CURRENT_DATE"
+            row = await conn.fetchrow(
+                "SELECT COUNT(*) FILTER (WHERE NOT is_used) AS available, COUNT(*) FILTER (WHERE is_used) AS used FROM mails"
             )
+            return row['available'], row['used']
+
+    async def count_today_given(self) -> int:
+        val = await self._read(None, "fetchval", "SELECT issued FROM issuance_daily WHERE day = CURRENT_DATE")
+        return val or 0
+
+    async def count_issued_total(self) -> int:
+        return await self._read(None, "fetchval", "SELECT COALESCE(SUM(issued), 0) FROM issuance_daily")
+
+    async def count_issuing_users(self) -> int:
+        return await self._read(None, "fetchval", "SELECT COUNT(DISTINCT user_id) FROM issuance_user_daily")
+
+    async def get_daily_issuance(self, days: int):
+        return await self._read(
+            None, "fetch",
+            "SELECT day, issued FROM issuance_daily WHERE day > CURRENT_DATE - $1::int ORDER BY day",
+            days
+        )
 
     async def delete_unused_mails(self) -> int:
         async with self.pool.acquire() as conn:
             result = await conn.execute("DELETE FROM mails WHERE is_used = FALSE")
-            return int(result.split()[-1])
+        self._wrote()
+        return int(result.split()[-1])
 
     async def delete_used_mails(self) -> int:
         async with self.pool.acquire() as conn:
-            result = await conn.execute("DELETE FROM mails WHERE is_used = TRUE")
-            return int(result.split()[-1])
+            async with conn.transaction():
+                result = await conn.execute("DELETE FROM mails WHERE is_used = TRUE")
+                await self._clear_rollups(conn)
+        self._wrote()
+        return int(result.split()[-1])
 
     async def delete_all_mails(self) -> int:
         async with self.pool.acquire() as conn:
-            result = await conn.execute("DELETE FROM mails")
-            return int(result.split()[-1])
+            async with conn.transaction():
+                result = await conn.execute("DELETE FROM mails")
+                await self._clear_rollups(conn)
+        self._wrote()
+        return int(result.split()[-1])
+
+    async def _clear_rollups(self, conn: asyncpg.Connection):
+        # Вместе с историей выдач уходят и счётчики по ней
+        await conn.execute("TRUNCATE issuance_daily, issuance_user_daily")
 
     async def get_user_today_count(self, user_id: int) -> int:
+        val = await self._read(
+            user_id, "fetchval",
+            "SELECT issued FROM issuance_user_daily WHERE user_id = $1 AND day = CURRENT_DATE",
+            user_id
+        )
+        return val or 0
+
+    async def get_user_issued_total(self, user_id: int) -> int:
+        return await self._read(
+            user_id, "fetchval",
+            "SELECT COALESCE(SUM(issued), 0) FROM issuance_user_daily WHERE user_id = $1",
+            user_id
+        )
+
+    async def get_user_mails(self, user_id: int):
+        return await self._read(
+            user_id, "fetch",
+            "SELECT email || ':' || password AS mail, used_at FROM mails WHERE used_by = $1 ORDER BY used_at DESC",
+            user_id
+        )
+
+    async def get_user_mails_by_date(self, user_id: int, date: str):
+        return await self._read(
+            user_id, "fetch",
+            "SELECT email || ':' || password AS mail, used_at FROM mails WHERE used_by = $1 AND used_at::date = $2::text::date ORDER BY used_at DESC",
+            user_id, date
+        )
+
+    async def get_user_mails_by_month(self, user_id: int, month: str):
+        return await self._read(
+            user_id, "fetch",
+            "SELECT email || ':' || password AS mail, used_at FROM mails WHERE used_by = $1 AND to_char(used_at, 'YYYY-MM') = $2 ORDER BY used_at DESC",
+            user_id, month
+        )
+
+    async def get_user_active_months(self, user_id: int):
+        rows = await self._read(
+            user_id, "fetch",
+            "SELECT DISTINCT to_char(day, 'YYYY-MM') as m FROM issuance_user_daily WHERE user_id = $1 ORDER BY m DESC",
+            user_id
+        )
+        return [row['m'] for row in rows]
+
+    # ---- Import jobs ----
+
+    async def create_import_job(self, file_id: str, file_unique_id: str, file_name: str,
+                                chat_id: int, message_id: int) -> tuple[int, bool]:
+        """Ставит файл в очередь. Если он уже в очереди — возвращает (id, False)."""
+        async with self.pool.acquire() as conn:
+            job_id = await conn.fetchval("""
+                INSERT INTO import_jobs (file_id, file_unique_id, file_name, chat_id, message_id)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (file_unique_id) WHERE status IN ('queued', 'running') DO NOTHING
+                RETURNING id
+            """, file_id, file_unique_id, file_name, chat_id, message_id)
+            if job_id is not None:
+                return job_id, True
+            job_id = await conn.fetchval("""
+                SELECT id FROM import_jobs
+                WHERE file_unique_id = $1 AND status IN ('queued', 'running')
+            """, file_unique_id)
+            return job_id, False
+
+    async def claim_import_job(self):
+        """Следующая задача; начатая до перезапуска продолжается первой."""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow("""
+                UPDATE import_jobs SET status = 'running'
+                WHERE id = (
+                    SELECT id FROM import_jobs WHERE status IN ('queued', 'running')
+                    ORDER BY status = 'running' DESC, id LIMIT 1
+                )
+                RETURNING *
+            """)
+
+    async def count_queued_imports(self, before_id: int) -> int:
         async with self.pool.acquire() as conn:
             return await conn.fetchval(
-                "SELECT COUNT(*) FROM mails WHERE used_by = $1 AND used_at::date = CURRENT_DATE",
-                user_id
+                "SELECT COUNT(*) FROM import_jobs WHERE status IN ('queued', 'running') AND id < $1",
+                before_id
             )
 
-    async def get_user_mails(self, user_id: int):
+    async def start_import_job(self, job_id: int, total: int, in_file: int):
         async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                "SELECT mail, used_at FROM mails WHERE used_by = $1 ORDER BY used_at DESC",
-                user_id
+            await conn.execute(
+                "UPDATE import_jobs SET total = $2, in_file = $3 WHERE id = $1",
+                job_id, total, in_file
             )
 
-    async def get_user_mails_by_date(self, user_id: int, date: str):
+    async def import_batch(self, job_id: int, mails: list[str], position: int, known: int) -> tuple[int, int]:
+        """Вставляет пачку и сдвигает position задачи в одной транзакции."""
         async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                "SELECT mail, used_at FROM mails WHERE used_by = $1 AND used_at::date = $2 ORDER BY used_at DESC",
-                user_id, date
-            )
+            async with conn.transaction():
+                added, duplicates = await self._insert_mails(conn, mails) if mails else (0, 0)
+                await conn.execute("""
+                    UPDATE import_jobs SET position = $2, added = added + $3, known = known + $4
+                    WHERE id = $1
+                """, job_id, position, added, known + duplicates)
+        self._wrote()
+        return added, duplicates
 
-    async def get_user_mails_by_month(self, user_id: int, month: str):
+    async def finish_import_job(self, job_id: int, status: str, error: str | None = None):
         async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                "SELECT mail, used_at FROM mails WHERE used_by = $1 AND to_char(used_at, 'YYYY-MM') = $2 ORDER BY used_at DESC",
-                user_id, month
+            await conn.execute(
+                "UPDATE import_jobs SET status = $2, error = $3, finished_at = NOW() WHERE id = $1",
+                job_id, status, error
             )
 
-    async def get_user_active_months(self, user_id: int):
+    # ---- Broadcasts ----
+
+    async def count_reachable_users(self) -> int:
+        return await self._read(None, "fetchval", "SELECT COUNT(*) FROM users WHERE blocked_at IS NULL")
+
+    async def get_broadcast_recipients(self, after_user_id: int, limit: int) -> list[int]:
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT user_id FROM users
+                WHERE user_id > $1 AND blocked_at IS NULL
+                ORDER BY user_id LIMIT $2
+            """, after_user_id, limit)
+            return [row['user_id'] for row in rows]
+
+    async def mark_users_blocked(self, user_ids: list[int]):
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(
-                "SELECT DISTINCT to_char(used_at, 'YYYY-MM') as m FROM mails WHERE used_by = $1 ORDER BY m DESC",
-                user_id
+            await conn.execute(
+                "UPDATE users SET blocked_at = NOW() WHERE user_id = ANY($1::bigint[])", user_ids
             )
-            return [row['m'] for row in rows]
+
+    async def create_broadcast(self, text: str, chat_id: int, message_id: int, total: int) -> int:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval("""
+                INSERT INTO broadcasts (text, chat_id, message_id, total)
+                VALUES ($1, $2, $3, $4) RETURNING id
+            """, text, chat_id, message_id, total)
+
+    async def claim_broadcast(self):
+        """Следующая рассылка; прерванная перезапуском продолжается первой."""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow("""
+                UPDATE broadcasts SET status = 'running'
+                WHERE id = (
+                    SELECT id FROM broadcasts WHERE status IN ('queued', 'running')
+                    ORDER BY status = 'running' DESC, id LIMIT 1
+                )
+                RETURNING *
+            """)
+
+    async def checkpoint_broadcast(self, broadcast_id: int, last_user_id: int,
+                                   sent: int, failed: int, blocked: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE broadcasts SET last_user_id = $2, sent = $3, failed = $4, blocked = $5
+                WHERE id = $1
+            """, broadcast_id, last_user_id, sent, failed, blocked)
+
+    async def finish_broadcast(self, broadcast_id: int, status: str) -> bool:
+        async with self.pool.acquire() as conn:
+            result = await conn.execute("""
+                UPDATE broadcasts SET status = $2, finished_at = NOW()
+                WHERE id = $1 AND status IN ('queued', 'running')
+            """, broadcast_id, status)
+            return result.split()[-1] != "0"
+
+    # ---- Quotas ----
+
+    async def now(self) -> datetime:
+        """LOCALTIMESTAMP сессии — те же часы и пояс, что у NOW() в take_mail и
+        у CURRENT_DATE. Смещение от часов процесса кешируется на CLOCK_REFRESH."""
+        if self._clock_skew is None or time.monotonic() - self._clock_checked > CLOCK_REFRESH:
+            async with self.pool.acquire() as conn:
+                self._clock_skew = await conn.fetchval("SELECT LOCALTIMESTAMP") - datetime.now()
+            self._clock_checked = time.monotonic()
+        return datetime.now() + self._clock_skew
+
+    async def get_quota_bucket(self, user_id: int) -> list[datetime]:
+        async with self.pool.acquire() as conn:
+            grants = await conn.fetchval("SELECT grants FROM quota_buckets WHERE user_id = $1", user_id)
+            return list(grants) if grants else []
+
+    async def get_user_quota(self, user_id: int):
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow("""
+                SELECT u.tier, u.daily_limit, t.daily_limit AS tier_limit
+                FROM users u
+                LEFT JOIN quota_tiers t ON t.name = u.tier
+                WHERE u.user_id = $1
+            """, user_id)
+
+    async def set_user_limit(self, user_id: int, limit: int | None):
+        async with self.pool.acquire() as conn:
+            await conn.execute("UPDATE users SET daily_limit = $2 WHERE user_id = $1", user_id, limit)
+
+    async def set_user_tier(self, user_id: int, tier: str | None):
+        async with self.pool.acquire() as conn:
+            await conn.execute("UPDATE users SET tier = $2 WHERE user_id = $1", user_id, tier)
+
+    async def get_tiers(self):
+        async with self.pool.acquire() as conn:
+            return await conn.fetch("SELECT name, daily_limit FROM quota_tiers ORDER BY daily_limit, name")
+
+    async def set_tier(self, name: str, limit: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute("""
+                INSERT INTO quota_tiers (name, daily_limit) VALUES ($1, $2)
+                ON CONFLICT (name) DO UPDATE SET daily_limit = $2
+            """, name, limit)
+
+    async def delete_tier(self, name: str) -> bool:
+        async with self.pool.acquire() as conn:
+            result = await conn.execute("DELETE FROM quota_tiers WHERE name = $1", name)
+            return result.split()[-1] != "0"
 
     # ---- Settings ----
 
@@ -188,6 +757,22 @@ class Database:
                 str(limit)
             )
 
+    async def get_quota_window(self) -> str:
+        async with self.pool.acquire() as conn:
+            val = await conn.fetchval("SELECT value FROM settings WHERE key = 'quota_window'")
+            return val or "daily"
+
+    async def set_quota_window(self, mode: str):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO settings (key, value) VALUES ('quota_window', $1) ON CONFLICT (key) DO UPDATE SET value=$1",
+                mode
+            )
+
     async def close(self):
+        if self._replica_monitor:
+            self._replica_monitor.cancel()
+        if self.replica:
+            await self.replica.close()
         if self.pool:
             await self.pool.close()
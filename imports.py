@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup
+
+from database import Database
+from mailfilter import MailFilter, dedupe_lines
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+# Не чаще одного редактирования статуса в столько секунд
+STATUS_INTERVAL = 2.0
+# Сбой посреди задачи (скачивание файла, связь с БД) — повтор через RETRY_DELAY
+# секунд; failed ставится только после MAX_ATTEMPTS сбоев подряд
+RETRY_DELAY = 10.0
+MAX_ATTEMPTS = 5
+
+
+def read_lines(data: bytes) -> list[str]:
+    content = data.decode("utf-8", errors="ignore")
+    return [line.strip() for line in content.splitlines() if line.strip() and ":" in line]
+
+
+class ImportWorker:
+    """Фоновая загрузка .txt файлов с почтами.
+
+    Хендлер только ставит файл в очередь import_jobs. Воркер берёт задачи
+    по одной, вставляет строки пачками по BATCH_SIZE и в той же транзакции
+    сохраняет позицию в файле — после перезапуска задача продолжается с
+    последней закоммиченной пачки. Упавшая задача остаётся running и
+    повторяется с той же позиции.
+    """
+
+    def __init__(self, bot: Bot, db: Database, mail_filter: MailFilter,
+                 reply_markup: InlineKeyboardMarkup, done_markup: InlineKeyboardMarkup | None = None):
+        self.bot = bot
+        self.db = db
+        self.mail_filter = mail_filter
+        self.reply_markup = reply_markup
+        self.done_markup = done_markup or reply_markup
+        self._wake = asyncio.Event()
+        self._attempts: dict[int, int] = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                job = await self.db.claim_import_job()
+            except Exception:
+                logger.exception("Не удалось взять задачу загрузки")
+                await asyncio.sleep(5)
+                continue
+            if job is None:
+                await self._wake.wait()
+                continue
+            try:
+                await self._process(job)
+                self._attempts.pop(job['id'], None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Загрузка #%s упала", job['id'])
+                await self._failed(job, e)
+
+    async def _failed(self, job, error: Exception):
+        job_id = job['id']
+        attempts = self._attempts.get(job_id, 0) + 1
+        self._attempts[job_id] = attempts
+        if attempts < MAX_ATTEMPTS:
+            await self._status(
+                job,
+                f"⚠️ <b>Загрузка #{job_id} приостановлена</b>\n\n"
+                f"Ошибка: <code>{error}</code>\n"
+                f"Повтор через {RETRY_DELAY:.0f} с (попытка {attempts + 1} из {MAX_ATTEMPTS})."
+            )
+            await asyncio.sleep(RETRY_DELAY)
+            return
+
+        try:
+            await self.db.finish_import_job(job_id, "failed", str(error))
+        except Exception:
+            # Задача остаётся running: следующий круг попробует её снова
+            logger.exception("Не удалось завершить загрузку #%s", job_id)
+            await asyncio.sleep(RETRY_DELAY)
+            return
+        self._attempts.pop(job_id, None)
+        await self._status(
+            job,
+            f"❌ <b>Загрузка #{job_id} прервана</b>\n\n"
+            f"Ошибка: <code>{error}</code>\n"
+            f"Попробуйте отправить файл ещё раз."
+        )
+
+    async def _status(self, job, text: str, reply_markup: InlineKeyboardMarkup | None = None):
+        if not job['message_id']:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text,
+                chat_id=job['chat_id'],
+                message_id=job['message_id'],
+                parse_mode="HTML",
+                reply_markup=reply_markup or self.reply_markup
+            )
+        except Exception:
+            pass
+
+    async def _process(self, job):
+        job_id = job['id']
+        file = await self.bot.download(job['file_id'])
+        lines = await asyncio.to_thread(read_lines, file.read())
+
+        if not lines:
+            await self.db.finish_import_job(job_id, "failed", "empty")
+            await self._status(
+                job,
+                "❌ <b>Файл пустой или неверный формат</b>\n\n"
+                "Не найдено строк в формате <code>почта:пароль</code>\n"
+                "Проверьте содержимое файла."
+            )
+            return
+
+        unique, in_file = await asyncio.to_thread(dedupe_lines, lines)
+        if job['total'] == 0:
+            await self.db.start_import_job(job_id, len(unique), in_file)
+
+        added = job['added']
+        known = job['known']
+        last_status = 0.0
+        for start in range(job['position'], len(unique), BATCH_SIZE):
+            batch = unique[start:start + BATCH_SIZE]
+            candidates, batch_known = await self.mail_filter.split_new(batch)
+            batch_added, duplicates = await self.db.import_batch(
+                job_id, candidates, start + len(batch), batch_known
+            )
+            await self.mail_filter.add(candidates)
+            added += batch_added
+            known += batch_known + duplicates
+
+            if time.monotonic() - last_status >= STATUS_INTERVAL:
+                last_status = time.monotonic()
+                await self._status(
+                    job,
+                    f"⏳ <b>Загрузка #{job_id}</b>\n\n"
+                    f"Обработано: <b>{start + len(batch)}</b> из <b>{len(unique)}</b>\n"
+                    f"📥 Добавлено: <b>{added}</b>\n"
+                    f"⚠️ Уже были в базе: <b>{known}</b>"
+                )
+
+        await self.db.finish_import_job(job_id, "done")
+        available = await self.db.count_available_mails()
+        await self._status(
+            job,
+            f"✅ <b>Загрузка #{job_id} завершена!</b>\n\n"
+            f"📥 Новых почт добавлено: <b>{added}</b>\n"
+            f"🔁 Повторов внутри файла: <b>{in_file}</b>\n"
+            f"⚠️ Уже были в базе: <b>{known}</b>\n\n"
+            f"📦 Всего доступно сейчас: <b>{available}</b>",
+            reply_markup=self.done_markup if added else None
+        )
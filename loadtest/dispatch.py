@@ -0,0 +1,130 @@
+"""Накладные расходы маршрутизации нажатий: цепочка фильтров против таблицы.
+
+Для каждого числа экранов N строятся два роутера с пустыми хендлерами:
+  filters — как было в bot.py: F.data == "screenI" на экран, а каждый
+            четвёртый экран с параметрами — F.data.startswith("itemI_")
+            и разбор split("_") в хендлере;
+  table   — CallbackTable из callbacks.py с N типизированными Payload.
+Через Dispatcher.feed_update подаются одинаковые нажатия, равномерно по
+экранам, и печатается среднее время на нажатие. Telegram не нужен.
+
+    python -m loadtest.dispatch --screens 10 30 100 300 --clicks 20000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import date
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.types import CallbackQuery, Update
+
+from callbacks import CallbackTable, Payload, UserMails, payload, to_base36
+
+TOKEN = "123456:fake-token-for-dispatch"
+USER_ID = 1234567890
+DAY = date(2026, 10, 19)
+
+
+async def noop(callback: CallbackQuery):
+    pass
+
+
+async def parse_item(callback: CallbackQuery):
+    parts = callback.data.split("_")
+    int(parts[1])
+    date.fromisoformat(parts[3])
+
+
+async def noop_payload(callback: CallbackQuery, callback_data: Payload):
+    pass
+
+
+def filter_router(screens: int) -> tuple[Router, list[str]]:
+    router = Router()
+    datas = []
+    for i in range(screens):
+        if i % 4 == 3:
+            router.callback_query.register(parse_item, F.data.startswith(f"item{i}_"))
+            datas.append(f"item{i}_{USER_ID}_d_{DAY.isoformat()}")
+        else:
+            router.callback_query.register(noop, F.data == f"screen{i}")
+            datas.append(f"screen{i}")
+    return router, datas
+
+
+def table_router(screens: int) -> tuple[Router, list[str]]:
+    table = CallbackTable()
+    router = Router()
+    router.callback_query.register(table.dispatch)
+    datas = []
+    for i in range(screens):
+        # Префиксы уникальны между прогонами с разным N
+        prefix = f"{to_base36(screens)}.{to_base36(i)}"
+        if i % 4 == 3:
+            cls = payload(prefix)(type(f"Item{i}", (Payload,), {"__annotations__": {"user_id": int, "day": date}}))
+            datas.append(cls(USER_ID, DAY).pack())
+        else:
+            cls = payload(prefix)(type(f"Screen{i}", (Payload,), {}))
+            datas.append(cls().pack())
+        table(cls)(noop_payload)
+    return router, datas
+
+
+def callback_update(update_id: int, data: str) -> Update:
+    user = {"id": USER_ID, "is_bot": False, "first_name": "Bench"}
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": "1",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": USER_ID, "type": "private"},
+                "text": "menu",
+            },
+        },
+    })
+
+
+async def measure(bot: Bot, router: Router, datas: list[str], clicks: int, seed: int) -> float:
+    dp = Dispatcher()
+    dp.include_router(router)
+    rng = random.Random(seed)
+    updates = [callback_update(i, rng.choice(datas)) for i in range(clicks)]
+    for update in updates[:500]:
+        await dp.feed_update(bot, update)
+
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / clicks
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--screens", type=int, nargs="+", default=[10, 30, 100, 300])
+    parser.add_argument("--clicks", type=int, default=20000, help="нажатий на каждый замер")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    old = f"pd_{USER_ID}_d_{DAY.isoformat()}"
+    new = UserMails(USER_ID, "d", DAY).pack()
+    print(f"callback_data кнопки «почты за день»: {old!r} ({len(old)} байт) → {new!r} ({len(new)} байт)")
+
+    bot = Bot(token=TOKEN)
+    print(f"\n{'экранов':>8}{'filters, мкс':>15}{'table, мкс':>13}{'ускорение':>12}")
+    try:
+        for screens in args.screens:
+            before = await measure(bot, *filter_router(screens), args.clicks, args.seed)
+            after = await measure(bot, *table_router(screens), args.clicks, args.seed)
+            print(f"{screens:>8}{before * 1e6:>15.1f}{after * 1e6:>13.1f}{before / after:>11.1f}x")
+    finally:
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+
+class FakeBotAPI:
+    """Локальная замена api.telegram.org для нагрузочных прогонов.
+
+    Понимает методы, которые вызывает bot.py (sendMessage, editMessageText,
+    answerCallbackQuery, getFile, ...), отдаёт файлы, добавленные через
+    add_file(), и умеет добавлять задержку и ответы 429.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 ratio_429: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.ratio_429 = ratio_429
+        self.retry_after = retry_after
+        self.files: dict[str, bytes] = {}
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self._message_ids = itertools.count(1_000_000)
+        self._runner: web.AppRunner | None = None
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self._method)
+        self.app.router.add_get("/file/bot{token}/{path:.+}", self._file)
+
+    def add_file(self, file_id: str, content: bytes):
+        self.files[file_id] = content
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    # ---- Обработчики ----
+
+    async def _payload(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        form = await request.post()
+        return {key: value for key, value in form.items() if isinstance(value, str)}
+
+    def _message(self, payload: dict, message_id: int | None = None) -> dict:
+        chat_id = int(payload.get("chat_id", 0))
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": payload.get("text", ""),
+        }
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        payload = await self._payload(request)
+        self.calls[method] += 1
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method == "getUpdates":
+            # Апдейты подаются в Dispatcher напрямую, long polling просто ждёт
+            await asyncio.sleep(min(float(payload.get("timeout", 1) or 1), 1.0))
+            return self._ok([])
+
+        if self.ratio_429 and method != "getMe" and random.random() < self.ratio_429:
+            self.rejected[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method in ("sendMessage", "sendDocument"):
+            return self._ok(self._message(payload))
+        if method == "editMessageText":
+            if "inline_message_id" in payload:
+                return self._ok(True)
+            return self._ok(self._message(payload, int(payload.get("message_id", 0))))
+        if method == "getFile":
+            file_id = payload.get("file_id", "")
+            if file_id not in self.files:
+                return web.json_response(
+                    {"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"},
+                    status=400
+                )
+            return self._ok({
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self.files[file_id]),
+                "file_path": f"documents/{file_id}.txt",
+            })
+        # answerCallbackQuery, deleteWebhook, setMyCommands и прочее
+        return self._ok(True)
+
+    async def _file(self, request: web.Request) -> web.Response:
+        path = request.match_info["path"]
+        file_id = path.rsplit("/", 1)[-1].removesuffix(".txt")
+        if file_id not in self.files:
+            raise web.HTTPNotFound()
+        return web.Response(body=self.files[file_id])
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
+
+
+async def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Фейковый Bot API: TELEGRAM_API_URL=http://host:port python bot.py")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--ratio-429", type=float, default=0.0, help="доля ответов 429")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.latency, args.jitter, args.ratio_429)
+    url = await api.start(port=args.port)
+    print(f"Fake Bot API: {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
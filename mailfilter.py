@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+from array import array
+from bisect import bisect_left
+
+from database import Database, split_mail
+
+# Сколько новых ключей копится в множестве, прежде чем влить их в отсортированный массив
+MERGE_THRESHOLD = 50_000
+# Сортировка по корзинам старших бит: хеши распределены равномерно
+SORT_BUCKET_BITS = 12
+
+
+def email_key(email: str) -> int:
+    # Регистр не различается, как в уникальном индексе mails
+    return int.from_bytes(hashlib.blake2b(email.lower().encode(), digest_size=8).digest(), "big")
+
+
+def mail_key(mail: str) -> int:
+    return email_key(split_mail(mail)[0])
+
+
+def dedupe_lines(lines: list[str]) -> tuple[list[str], int]:
+    """Убирает повторы почт внутри файла (первая строка с почтой побеждает)."""
+    unique: dict[str, str] = {}
+    for line in lines:
+        unique.setdefault(split_mail(line)[0].lower(), line)
+    return list(unique.values()), len(lines) - len(unique)
+
+
+def sort_keys(keys: array) -> array:
+    """Сортирует хеши по корзинам старших бит.
+
+    Один sorted() по миллионам ключей держит GIL целиком, и event loop стоит,
+    даже если сортировка идёт в потоке. Здесь GIL отпускается между шагами
+    цикла, а каждая корзина сортируется за микросекунды.
+    """
+    shift = 64 - SORT_BUCKET_BITS
+    buckets = [array("Q") for _ in range(1 << SORT_BUCKET_BITS)]
+    for key in keys:
+        buckets[key >> shift].append(key)
+    out = array("Q")
+    for bucket in buckets:
+        out.extend(sorted(bucket))
+    return out
+
+
+def merge_sorted(keys: array, new: list[int]) -> array:
+    """Сливает отсортированный массив с отсортированным списком без пересортировки.
+
+    Между новыми ключами массив копируется срезами, позиция — по bisect.
+    """
+    out = array("Q")
+    start = 0
+    for key in new:
+        end = bisect_left(keys, key, start)
+        out.extend(keys[start:end])
+        out.append(key)
+        start = end
+    out.extend(keys[start:])
+    return out
+
+
+class MailFilter:
+    """Фильтр уже загруженных почт перед вставкой в БД.
+
+    Хранит отсортированный массив 64-битных хешей всех email из mails
+    (8 байт на почту) и строится по таблице один раз при первой загрузке.
+    Совпадение хеша считается дубликатом без обращения к БД; строки без
+    совпадения уходят в INSERT, где уникальный индекс остаётся последней
+    проверкой. Сортировка и слияние массива идут в потоке, чтобы большая
+    база не останавливала обработку апдейтов.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._sorted = array("Q")
+        self._recent: set[int] = set()
+        self._loaded = False
+        # Растёт при invalidate: результат сортировки, начатой раньше, выбрасывается
+        self._generation = 0
+
+    def invalidate(self):
+        """Вызывать после удаления почт — фильтр пересоберётся при следующей загрузке."""
+        self._sorted = array("Q")
+        self._recent.clear()
+        self._loaded = False
+        self._generation += 1
+
+    async def _load(self):
+        generation = self._generation
+        keys = array("Q")
+        async for email in self.db.iter_emails():
+            keys.append(email_key(email))
+        keys = await asyncio.to_thread(sort_keys, keys)
+        if generation == self._generation:
+            self._sorted = keys
+            self._recent.clear()
+            self._loaded = True
+
+    def _contains(self, key: int) -> bool:
+        if key in self._recent:
+            return True
+        i = bisect_left(self._sorted, key)
+        return i < len(self._sorted) and self._sorted[i] == key
+
+    async def add(self, mails: list[str]):
+        self._recent.update(mail_key(mail) for mail in mails)
+        if len(self._recent) < MERGE_THRESHOLD:
+            return
+        generation = self._generation
+        new = list(self._recent)
+        merged = await asyncio.to_thread(lambda: merge_sorted(self._sorted, sorted(new)))
+        # Пока шло слияние, ключи из new по-прежнему находятся через _recent
+        if generation == self._generation:
+            self._sorted = merged
+            self._recent.difference_update(new)
+
+    async def split_new(self, mails: list[str]) -> tuple[list[str], int]:
+        """Возвращает вероятно новые почты и число уже известных."""
+        if not self._loaded:
+            await self._load()
+        new = [mail for mail in mails if not self._contains(mail_key(mail))]
+        return new, len(mails) - len(new)
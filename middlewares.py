@@ -0,0 +1,69 @@
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from callbacks import Payload, unpack
+
+
+class AntiFloodMiddleware(BaseMiddleware):
+    """Защита от частых нажатий на инлайн-кнопки.
+
+    Регистрируется как outer-middleware на callback_query, поэтому лишние
+    нажатия отсекаются до фильтров и хендлеров и не трогают БД:
+      - пока хендлер для (пользователь, кнопка) выполняется, повторные
+        нажатия той же кнопки сливаются с ним и получают только answer().
+        Кнопка — разобранный Payload, так что старое и новое callback_data
+        одного действия считаются одним нажатием;
+      - на каждого пользователя действует token bucket: burst нажатий подряд,
+        дальше rate нажатий в секунду.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, exempt: set[int] | None = None):
+        self.rate = rate
+        self.burst = burst
+        self.exempt = exempt or set()
+        self._in_flight: set[tuple[int, Payload | str]] = set()
+        self._buckets: dict[int, tuple[float, float]] = {}
+
+    def _take_token(self, user_id: int) -> bool:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            return False
+        self._buckets[user_id] = (tokens - 1, now)
+
+        # Полные корзины ничем не отличаются от отсутствующих
+        if len(self._buckets) > 10000:
+            full_after = self.burst / self.rate
+            self._buckets = {
+                uid: (t, ts) for uid, (t, ts) in self._buckets.items() if now - ts < full_after
+            }
+        return True
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: dict[str, Any],
+    ) -> Any:
+        user_id = event.from_user.id
+        data = event.data or ""
+        key = (user_id, unpack(data) or data)
+
+        if key in self._in_flight:
+            await event.answer("⏳ Уже выполняется...")
+            return None
+
+        if user_id not in self.exempt and not self._take_token(user_id):
+            await event.answer("🐢 Слишком часто, подождите пару секунд")
+            return None
+
+        self._in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(key)
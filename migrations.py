@@ -0,0 +1,268 @@
+import logging
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock: одновременно схему обновляет только один процесс
+MIGRATION_LOCK_KEY = 0x6D61696C626F74
+
+
+# Каждая миграция выполняется один раз в своей транзакции. Миграции написаны
+# идемпотентно: базы, созданные до schema_version, проходят их без изменений.
+
+async def initial_schema(conn: asyncpg.Connection):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT DEFAULT '',
+            full_name TEXT DEFAULT '',
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS mails (
+            id SERIAL PRIMARY KEY,
+            mail TEXT UNIQUE NOT NULL,
+            is_used BOOLEAN DEFAULT FALSE,
+            used_by BIGINT REFERENCES users(user_id),
+            used_at TIMESTAMP
+        )
+    """)
+
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+    await conn.execute("""
+        INSERT INTO settings (key, value) VALUES ('daily_limit', '3')
+        ON CONFLICT (key) DO NOTHING
+    """)
+
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_mails_is_used ON mails(is_used)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_mails_used_by ON mails(used_by)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_mails_used_at ON mails(used_at)")
+
+
+async def quotas(conn: asyncpg.Connection):
+    await conn.execute("""
+        INSERT INTO settings (key, value) VALUES ('quota_window', 'daily')
+        ON CONFLICT (key) DO NOTHING
+    """)
+
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS quota_tiers (
+            name TEXT PRIMARY KEY,
+            daily_limit INT NOT NULL
+        )
+    """)
+
+    await conn.execute(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS tier TEXT REFERENCES quota_tiers(name) ON DELETE SET NULL"
+    )
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS daily_limit INT")
+
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS quota_buckets (
+            user_id BIGINT PRIMARY KEY REFERENCES users(user_id),
+            grants TIMESTAMP[] NOT NULL DEFAULT '{}'
+        )
+    """)
+
+    # Заполняем корзины квот из истории выдач за последние сутки
+    await conn.execute("""
+        INSERT INTO quota_buckets (user_id, grants)
+        SELECT used_by, array_agg(used_at ORDER BY used_at)
+        FROM mails
+        WHERE used_by IS NOT NULL AND used_at > NOW() - INTERVAL '24 hours'
+        GROUP BY used_by
+        ON CONFLICT (user_id) DO NOTHING
+    """)
+
+
+async def split_mails(conn: asyncpg.Connection):
+    """mails(mail TEXT UNIQUE) -> email (как загружен) + password.
+
+    Уникальность — по выражению md5(lower(email))::uuid: 16 байт в индексе,
+    в строке ничего не хранится. Повторы одной почты в истории выдач
+    помечены is_repeat и в уникальность не входят.
+    """
+    has_raw = await conn.fetchval("""
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'mails' AND column_name = 'mail'
+        )
+    """)
+    if has_raw:
+        # is_repeat первым: 1 байт сразу за used_at, до текстовых колонок без выравнивания
+        await conn.execute("""
+            ALTER TABLE mails
+                ADD COLUMN IF NOT EXISTS is_repeat BOOLEAN NOT NULL DEFAULT FALSE,
+                ADD COLUMN IF NOT EXISTS email TEXT,
+                ADD COLUMN IF NOT EXISTS password TEXT
+        """)
+        await conn.execute("""
+            UPDATE mails SET
+                email = split_part(mail, ':', 1),
+                password = substr(mail, strpos(mail, ':') + 1)
+        """)
+        # Невыданные повторы одной почты удаляем, оставляя выданную или самую раннюю
+        await conn.execute("""
+            DELETE FROM mails m USING mails o
+            WHERE lower(m.email) = lower(o.email) AND m.is_used = FALSE AND (o.is_used OR o.id < m.id)
+        """)
+        await conn.execute("""
+            UPDATE mails m SET is_repeat = TRUE
+            WHERE EXISTS (SELECT 1 FROM mails o WHERE lower(o.email) = lower(m.email) AND o.id < m.id)
+        """)
+        await conn.execute("""
+            ALTER TABLE mails
+                DROP COLUMN mail,
+                ALTER COLUMN email SET NOT NULL,
+                ALTER COLUMN password SET NOT NULL
+        """)
+
+    await conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_mails_email_key
+        ON mails ((md5(lower(email))::uuid)) WHERE NOT is_repeat
+    """)
+    await conn.execute("DROP INDEX IF EXISTS idx_mails_is_used")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_mails_free ON mails(id) WHERE is_used = FALSE")
+
+
+async def import_jobs(conn: asyncpg.Connection):
+    # position — сколько уникальных строк файла уже закоммичено
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id SERIAL PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT NOT NULL,
+            file_name TEXT DEFAULT '',
+            chat_id BIGINT NOT NULL,
+            message_id BIGINT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INT NOT NULL DEFAULT 0,
+            position INT NOT NULL DEFAULT 0,
+            added INT NOT NULL DEFAULT 0,
+            in_file INT NOT NULL DEFAULT 0,
+            known INT NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT NOW(),
+            finished_at TIMESTAMP
+        )
+    """)
+    # Один и тот же файл не может стоять в очереди дважды
+    await conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_import_jobs_active
+        ON import_jobs(file_unique_id) WHERE status IN ('queued', 'running')
+    """)
+
+
+async def broadcasts(conn: asyncpg.Connection):
+    # Пользователи, заблокировавшие бота или удалённые, пропускаются в рассылках
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP")
+
+    # last_user_id — чекпоинт: все получатели с меньшим user_id уже обработаны
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            message_id BIGINT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INT NOT NULL DEFAULT 0,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INT NOT NULL DEFAULT 0,
+            failed INT NOT NULL DEFAULT 0,
+            blocked INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT NOW(),
+            finished_at TIMESTAMP
+        )
+    """)
+
+
+async def issuance_rollups(conn: asyncpg.Connection):
+    # Счётчики выдач по дням и по (пользователь, день), обновляются вместе с выдачей
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS issuance_daily (
+            day DATE PRIMARY KEY,
+            issued INT NOT NULL DEFAULT 0
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS issuance_user_daily (
+            user_id BIGINT NOT NULL REFERENCES users(user_id),
+            day DATE NOT NULL,
+            issued INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+    """)
+
+    # Бэкфилл из уже выданных почт
+    await conn.execute("""
+        INSERT INTO issuance_daily (day, issued)
+        SELECT used_at::date, COUNT(*) FROM mails
+        WHERE is_used = TRUE AND used_at IS NOT NULL
+        GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET issued = EXCLUDED.issued
+    """)
+    await conn.execute("""
+        INSERT INTO issuance_user_daily (user_id, day, issued)
+        SELECT used_by, used_at::date, COUNT(*) FROM mails
+        WHERE is_used = TRUE AND used_by IS NOT NULL AND used_at IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, day) DO UPDATE SET issued = EXCLUDED.issued
+    """)
+
+
+MIGRATIONS = [
+    (1, initial_schema),
+    (2, quotas),
+    (3, split_mails),
+    (4, import_jobs),
+    (5, broadcasts),
+    (6, issuance_rollups),
+]
+
+
+async def current_version(conn: asyncpg.Connection) -> int:
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(pool: asyncpg.Pool):
+    """Применяет недостающие миграции. В обычном запуске — один SELECT."""
+    latest = MIGRATIONS[-1][0]
+    async with pool.acquire() as conn:
+        if await current_version(conn) >= latest:
+            return
+
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_KEY)
+        try:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT NOW()
+                )
+            """)
+            # Пока ждали блокировку, миграции мог применить другой процесс
+            version = await current_version(conn)
+            for number, migration in MIGRATIONS:
+                if number <= version:
+                    continue
+                async with conn.transaction():
+                    await migration(conn)
+                    await conn.execute(
+                        "INSERT INTO schema_version (version, name) VALUES ($1, $2)",
+                        number, migration.__name__
+                    )
+                logger.info("Миграция %s (%s) применена", number, migration.__name__)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_KEY)
@@ -0,0 +1,137 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+
+from database import Database
+
+WINDOW = timedelta(hours=24)
+
+
+@dataclass
+class QuotaDecision:
+    used: int
+    limit: int
+    rolling: bool
+    reset_at: datetime | None
+
+    @property
+    def allowed(self) -> bool:
+        return self.used < self.limit
+
+    @property
+    def remaining(self) -> int:
+        return max(self.limit - self.used, 0)
+
+
+class QuotaEngine:
+    """Квоты выдачи почт.
+
+    Для каждого пользователя в памяти хранится корзина — времена выдач за
+    последние 24 часа. Решение о выдаче считается по корзине, без запросов
+    к истории в mails. В quota_buckets выдачу дописывает сам take_mail в
+    той же транзакции; из БД корзина читается один раз при первом обращении.
+
+    Время берётся по часам БД (db.now()), в которых take_mail записывает
+    выдачи: иначе при разных часовых поясах контейнера и БД окно сдвигается,
+    а «сегодня» расходится со счётчиками выдач.
+
+    Режимы окна (settings.quota_window):
+      daily   — календарные сутки, сброс в полночь;
+      rolling — скользящие 24 часа от каждой выдачи.
+
+    Лимит пользователя: персональный > лимит тарифа > общий daily_limit.
+
+    check → take_mail → commit одного пользователя выполняются под
+    user_lock: иначе два одновременных запроса оба проходят check до того,
+    как первый сделает commit, и лимит превышается.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._buckets: dict[int, list[datetime]] = {}
+        self._limits: dict[int, tuple[int | None, int | None]] = {}
+        self._default_limit: int | None = None
+        self._rolling: bool | None = None
+        self._locks: dict[int, tuple[asyncio.Lock, int]] = {}
+
+    # ---- Настройки ----
+
+    async def default_limit(self) -> int:
+        if self._default_limit is None:
+            self._default_limit = await self.db.get_daily_limit()
+        return self._default_limit
+
+    async def is_rolling(self) -> bool:
+        if self._rolling is None:
+            self._rolling = await self.db.get_quota_window() == "rolling"
+        return self._rolling
+
+    async def limit_for(self, user_id: int) -> int:
+        if user_id not in self._limits:
+            row = await self.db.get_user_quota(user_id)
+            self._limits[user_id] = (row['daily_limit'], row['tier_limit']) if row else (None, None)
+        personal, tier = self._limits[user_id]
+        if personal is not None:
+            return personal
+        if tier is not None:
+            return tier
+        return await self.default_limit()
+
+    def invalidate(self, user_id: int | None = None):
+        """Сбрасывает закешированные лимиты после изменений из админки."""
+        if user_id is None:
+            self._limits.clear()
+            self._default_limit = None
+            self._rolling = None
+        else:
+            self._limits.pop(user_id, None)
+
+    @asynccontextmanager
+    async def user_lock(self, user_id: int):
+        lock, holders = self._locks.get(user_id, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[user_id] = (lock, holders + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, holders = self._locks[user_id]
+            if holders == 1:
+                del self._locks[user_id]
+            else:
+                self._locks[user_id] = (lock, holders - 1)
+
+    # ---- Корзины ----
+
+    async def _bucket(self, user_id: int, now: datetime) -> list[datetime]:
+        grants = self._buckets.get(user_id)
+        if grants is None:
+            grants = await self.db.get_quota_bucket(user_id)
+            self._buckets[user_id] = grants
+        cutoff = now - WINDOW
+        if grants and grants[0] <= cutoff:
+            grants[:] = [g for g in grants if g > cutoff]
+        return grants
+
+    async def check(self, user_id: int, now: datetime | None = None) -> QuotaDecision:
+        now = now or await self.db.now()
+        grants = await self._bucket(user_id, now)
+        limit = await self.limit_for(user_id)
+
+        if await self.is_rolling():
+            used = len(grants)
+            # Слот освобождается, когда из окна выпадает самая старая лишняя выдача
+            reset_at = grants[used - limit] + WINDOW if used >= limit > 0 else None
+            return QuotaDecision(used, limit, True, reset_at)
+
+        start = datetime.combine(now.date(), time.min)
+        used = sum(1 for g in grants if g >= start)
+        return QuotaDecision(used, limit, False, start + timedelta(days=1))
+
+    def commit(self, user_id: int, granted_at: datetime):
+        """Добавляет в корзину выдачу, уже записанную take_mail в quota_buckets."""
+        grants = self._buckets.get(user_id)
+        # Незагруженная корзина прочитается из БД уже с этой выдачей
+        if grants is not None:
+            grants.append(granted_at)
@@ -0,0 +1,513 @@
+import asyncio
+import json
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+from database import Database, split_mail
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+
+# Как idx_mails_email_key в Postgres, но по самому lower(email): md5 в SQLite нет.
+# Встроенный lower() меняет регистр только у ASCII.
+MAIL_KEY_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_mails_email_key ON mails(lower(email)) WHERE is_repeat = 0"
+
+# Версия схемы хранится в PRAGMA user_version
+SCHEMA = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS quota_tiers (
+            name TEXT PRIMARY KEY,
+            daily_limit INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT DEFAULT '',
+            full_name TEXT DEFAULT '',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tier TEXT REFERENCES quota_tiers(name) ON DELETE SET NULL,
+            daily_limit INTEGER,
+            blocked_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS mails (
+            id INTEGER PRIMARY KEY,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            is_used INTEGER NOT NULL DEFAULT 0,
+            is_repeat INTEGER NOT NULL DEFAULT 0,
+            used_by INTEGER REFERENCES users(user_id),
+            used_at TIMESTAMP
+        )
+        """,
+        MAIL_KEY_INDEX,
+        "CREATE INDEX IF NOT EXISTS idx_mails_free ON mails(id) WHERE is_used = 0",
+        "CREATE INDEX IF NOT EXISTS idx_mails_used_by ON mails(used_by)",
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """,
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('daily_limit', '3'), ('quota_window', 'daily')",
+        """
+        CREATE TABLE IF NOT EXISTS quota_buckets (
+            user_id INTEGER PRIMARY KEY REFERENCES users(user_id),
+            grants TEXT NOT NULL DEFAULT '[]'
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT NOT NULL,
+            file_name TEXT DEFAULT '',
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INTEGER NOT NULL DEFAULT 0,
+            position INTEGER NOT NULL DEFAULT 0,
+            added INTEGER NOT NULL DEFAULT 0,
+            in_file INTEGER NOT NULL DEFAULT 0,
+            known INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY,
+            text TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            total INTEGER NOT NULL DEFAULT 0,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS issuance_daily (
+            day DATE PRIMARY KEY,
+            issued INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS issuance_user_daily (
+            user_id INTEGER NOT NULL REFERENCES users(user_id),
+            day DATE NOT NULL,
+            issued INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+        """,
+    ]),
+]
+
+MAIL_COLUMNS = "email || ':' || password AS mail, used_at"
+
+
+class SQLiteDatabase(Database):
+    """Встроенное хранилище в одном файле SQLite (WAL).
+
+    Для небольших установок и локальных прогонов без сервера Postgres.
+    Все запросы идут через одно соединение по очереди (asyncio.Lock) в
+    отдельном потоке, поэтому выдача почты и счётчики обновляются атомарно
+    без блокировок строк. Семантика методов — как у PostgresDatabase.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = await asyncio.to_thread(
+            sqlite3.connect, self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, isolation_level=None
+        )
+        self.conn.row_factory = sqlite3.Row
+        await self._call(self._init)
+
+    def _init(self):
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, statements in SCHEMA:
+            if number <= version:
+                continue
+            self._in_transaction(lambda conn: [conn.execute(sql) for sql in statements])
+            self.conn.execute(f"PRAGMA user_version = {number}")
+
+    # ---- Выполнение запросов ----
+
+    async def _call(self, fn: Callable, *args):
+        async with self._lock:
+            return await asyncio.to_thread(fn, *args)
+
+    def _in_transaction(self, fn: Callable[[sqlite3.Connection], object]):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(self.conn)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        return result
+
+    async def _transaction(self, fn: Callable[[sqlite3.Connection], object]):
+        return await self._call(self._in_transaction, fn)
+
+    async def _fetch(self, sql: str, *args) -> list[sqlite3.Row]:
+        return await self._call(lambda: self.conn.execute(sql, args).fetchall())
+
+    async def _fetchrow(self, sql: str, *args) -> sqlite3.Row | None:
+        return await self._call(lambda: self.conn.execute(sql, args).fetchone())
+
+    async def _fetchval(self, sql: str, *args):
+        row = await self._fetchrow(sql, *args)
+        return row[0] if row else None
+
+    async def _execute(self, sql: str, *args) -> int:
+        return await self._call(lambda: self.conn.execute(sql, args).rowcount)
+
+    # ---- Users ----
+
+    async def add_user(self, user_id: int, username: str, full_name: str):
+        await self._execute("""
+            INSERT INTO users (user_id, username, full_name) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username, full_name = excluded.full_name, blocked_at = NULL
+        """, user_id, username, full_name)
+
+    async def get_user_info(self, user_id: int):
+        return await self._fetchrow(
+            "SELECT user_id, username, full_name FROM users WHERE user_id = ?", user_id
+        )
+
+    async def count_users(self) -> int:
+        return await self._fetchval("SELECT COUNT(*) FROM users")
+
+    async def get_active_users(self):
+        return await self._fetch("""
+            SELECT u.user_id, u.username, u.full_name, r.cnt
+            FROM (
+                SELECT user_id, SUM(issued) AS cnt FROM issuance_user_daily GROUP BY user_id
+            ) r
+            JOIN users u ON u.user_id = r.user_id
+            ORDER BY r.cnt DESC
+        """)
+
+    # ---- Mails ----
+
+    @staticmethod
+    def _insert_mails(conn: sqlite3.Connection, mails: list[str]) -> tuple[int, int]:
+        cursor = conn.executemany(
+            "INSERT OR IGNORE INTO mails (email, password) VALUES (?, ?)", map(split_mail, mails)
+        )
+        return cursor.rowcount, len(mails) - cursor.rowcount
+
+    async def add_mails_bulk(self, mails: list[str]) -> tuple[int, int]:
+        return await self._transaction(lambda conn: self._insert_mails(conn, mails))
+
+    async def iter_emails(self, prefetch: int = 10000):
+        last_id = 0
+        while True:
+            rows = await self._fetch(
+                "SELECT id, email FROM mails WHERE is_repeat = 0 AND id > ? ORDER BY id LIMIT ?",
+                last_id, prefetch
+            )
+            if not rows:
+                return
+            for row in rows:
+                yield row['email']
+            last_id = rows[-1]['id']
+
+    async def take_mail(self, user_id: int) -> tuple[str, datetime] | None:
+        def grant(conn: sqlite3.Connection) -> tuple[str, datetime] | None:
+            row = conn.execute(
+                "SELECT id, email, password FROM mails WHERE is_used = 0 ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            now = datetime.now()
+            conn.execute(
+                "UPDATE mails SET is_used = 1, used_by = ?, used_at = ? WHERE id = ?",
+                (user_id, now, row['id'])
+            )
+            conn.execute("""
+                INSERT INTO issuance_daily (day, issued) VALUES (?, 1)
+                ON CONFLICT (day) DO UPDATE SET issued = issued + 1
+            """, (now.date(),))
+            conn.execute("""
+                INSERT INTO issuance_user_daily (user_id, day, issued) VALUES (?, ?, 1)
+                ON CONFLICT (user_id, day) DO UPDATE SET issued = issued + 1
+            """, (user_id, now.date()))
+            bucket = conn.execute("SELECT grants FROM quota_buckets WHERE user_id = ?", (user_id,)).fetchone()
+            cutoff = now - timedelta(hours=24)
+            grants = [g for g in json.loads(bucket['grants']) if datetime.fromisoformat(g) > cutoff] if bucket else []
+            conn.execute("""
+                INSERT INTO quota_buckets (user_id, grants) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET grants = excluded.grants
+            """, (user_id, json.dumps(grants + [now.isoformat()])))
+            return f"{row['email']}:{row['password']}", now
+
+        return await self._transaction(grant)
+
+    async def count_available_mails(self) -> int:
+        return await self._fetchval("SELECT COUNT(*) FROM mails WHERE is_used = 0")
+
+    async def count_used_mails(self) -> int:
+        return await self._fetchval("SELECT COUNT(*) FROM mails WHERE is_used = 1")
+
+    async def count_mails(self) -> tuple[int, int]:
+        row = await self._fetchrow(
+            "SELECT COUNT(*) - COALESCE(SUM(is_used), 0) AS available, COALESCE(SUM(is_used), 0) AS used FROM mails"
+        )
+        return row['available'], row['used']
+
+    async def count_today_given(self) -> int:
+        val = await self._fetchval("SELECT issued FROM issuance_daily WHERE day = ?", date.today())
+        return val or 0
+
+    async def count_issued_total(self) -> int:
+        return await self._fetchval("SELECT COALESCE(SUM(issued), 0) FROM issuance_daily")
+
+    async def count_issuing_users(self) -> int:
+        return await self._fetchval("SELECT COUNT(DISTINCT user_id) FROM issuance_user_daily")
+
+    async def get_daily_issuance(self, days: int):
+        return await self._fetch(
+            "SELECT day, issued FROM issuance_daily WHERE day > ? ORDER BY day",
+            date.today() - timedelta(days=days)
+        )
+
+    async def delete_unused_mails(self) -> int:
+        return await self._execute("DELETE FROM mails WHERE is_used = 0")
+
+    async def delete_used_mails(self) -> int:
+        return await self._transaction(lambda conn: self._delete_with_rollups(conn, "WHERE is_used = 1"))
+
+    async def delete_all_mails(self) -> int:
+        return await self._transaction(lambda conn: self._delete_with_rollups(conn, ""))
+
+    @staticmethod
+    def _delete_with_rollups(conn: sqlite3.Connection, where: str) -> int:
+        deleted = conn.execute(f"DELETE FROM mails {where}").rowcount
+        # Вместе с историей выдач уходят и счётчики по ней
+        conn.execute("DELETE FROM issuance_daily")
+        conn.execute("DELETE FROM issuance_user_daily")
+        return deleted
+
+    async def get_user_today_count(self, user_id: int) -> int:
+        val = await self._fetchval(
+            "SELECT issued FROM issuance_user_daily WHERE user_id = ? AND day = ?", user_id, date.today()
+        )
+        return val or 0
+
+    async def get_user_issued_total(self, user_id: int) -> int:
+        return await self._fetchval(
+            "SELECT COALESCE(SUM(issued), 0) FROM issuance_user_daily WHERE user_id = ?", user_id
+        )
+
+    async def get_user_mails(self, user_id: int):
+        return await self._fetch(
+            f"SELECT {MAIL_COLUMNS} FROM mails WHERE used_by = ? ORDER BY used_at DESC", user_id
+        )
+
+    async def get_user_mails_by_date(self, user_id: int, date: str):
+        return await self._fetch(
+            f"SELECT {MAIL_COLUMNS} FROM mails WHERE used_by = ? AND date(used_at) = ? ORDER BY used_at DESC",
+            user_id, date
+        )
+
+    async def get_user_mails_by_month(self, user_id: int, month: str):
+        return await self._fetch(
+            f"SELECT {MAIL_COLUMNS} FROM mails WHERE used_by = ? AND strftime('%Y-%m', used_at) = ? ORDER BY used_at DESC",
+            user_id, month
+        )
+
+    async def get_user_active_months(self, user_id: int):
+        rows = await self._fetch(
+            "SELECT DISTINCT substr(day, 1, 7) AS m FROM issuance_user_daily WHERE user_id = ? ORDER BY m DESC",
+            user_id
+        )
+        return [row['m'] for row in rows]
+
+    # ---- Import jobs ----
+
+    async def create_import_job(self, file_id: str, file_unique_id: str, file_name: str,
+                                chat_id: int, message_id: int) -> tuple[int, bool]:
+        def create(conn: sqlite3.Connection) -> tuple[int, bool]:
+            row = conn.execute(
+                "SELECT id FROM import_jobs WHERE file_unique_id = ? AND status IN ('queued', 'running')",
+                (file_unique_id,)
+            ).fetchone()
+            if row:
+                return row['id'], False
+            cursor = conn.execute("""
+                INSERT INTO import_jobs (file_id, file_unique_id, file_name, chat_id, message_id)
+                VALUES (?, ?, ?, ?, ?)
+            """, (file_id, file_unique_id, file_name, chat_id, message_id))
+            return cursor.lastrowid, True
+
+        return await self._transaction(create)
+
+    @staticmethod
+    def _claim(conn: sqlite3.Connection, table: str):
+        row = conn.execute(f"""
+            SELECT id FROM {table} WHERE status IN ('queued', 'running')
+            ORDER BY status = 'running' DESC, id LIMIT 1
+        """).fetchone()
+        if row is None:
+            return None
+        conn.execute(f"UPDATE {table} SET status = 'running' WHERE id = ?", (row['id'],))
+        return conn.execute(f"SELECT * FROM {table} WHERE id = ?", (row['id'],)).fetchone()
+
+    async def claim_import_job(self):
+        return await self._transaction(lambda conn: self._claim(conn, "import_jobs"))
+
+    async def count_queued_imports(self, before_id: int) -> int:
+        return await self._fetchval(
+            "SELECT COUNT(*) FROM import_jobs WHERE status IN ('queued', 'running') AND id < ?", before_id
+        )
+
+    async def start_import_job(self, job_id: int, total: int, in_file: int):
+        await self._execute("UPDATE import_jobs SET total = ?, in_file = ? WHERE id = ?", total, in_file, job_id)
+
+    async def import_batch(self, job_id: int, mails: list[str], position: int, known: int) -> tuple[int, int]:
+        def batch(conn: sqlite3.Connection) -> tuple[int, int]:
+            added, duplicates = self._insert_mails(conn, mails) if mails else (0, 0)
+            conn.execute("""
+                UPDATE import_jobs SET position = ?, added = added + ?, known = known + ?
+                WHERE id = ?
+            """, (position, added, known + duplicates, job_id))
+            return added, duplicates
+
+        return await self._transaction(batch)
+
+    async def finish_import_job(self, job_id: int, status: str, error: str | None = None):
+        await self._execute(
+            "UPDATE import_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            status, error, datetime.now(), job_id
+        )
+
+    # ---- Broadcasts ----
+
+    async def count_reachable_users(self) -> int:
+        return await self._fetchval("SELECT COUNT(*) FROM users WHERE blocked_at IS NULL")
+
+    async def get_broadcast_recipients(self, after_user_id: int, limit: int) -> list[int]:
+        rows = await self._fetch("""
+            SELECT user_id FROM users
+            WHERE user_id > ? AND blocked_at IS NULL
+            ORDER BY user_id LIMIT ?
+        """, after_user_id, limit)
+        return [row['user_id'] for row in rows]
+
+    async def mark_users_blocked(self, user_ids: list[int]):
+        now = datetime.now()
+        await self._transaction(lambda conn: conn.executemany(
+            "UPDATE users SET blocked_at = ? WHERE user_id = ?", [(now, uid) for uid in user_ids]
+        ))
+
+    async def create_broadcast(self, text: str, chat_id: int, message_id: int, total: int) -> int:
+        return await self._call(lambda: self.conn.execute(
+            "INSERT INTO broadcasts (text, chat_id, message_id, total) VALUES (?, ?, ?, ?)",
+            (text, chat_id, message_id, total)
+        ).lastrowid)
+
+    async def claim_broadcast(self):
+        return await self._transaction(lambda conn: self._claim(conn, "broadcasts"))
+
+    async def checkpoint_broadcast(self, broadcast_id: int, last_user_id: int,
+                                   sent: int, failed: int, blocked: int):
+        await self._execute("""
+            UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ?
+            WHERE id = ?
+        """, last_user_id, sent, failed, blocked, broadcast_id)
+
+    async def finish_broadcast(self, broadcast_id: int, status: str) -> bool:
+        updated = await self._execute("""
+            UPDATE broadcasts SET status = ?, finished_at = ?
+            WHERE id = ? AND status IN ('queued', 'running')
+        """, status, datetime.now(), broadcast_id)
+        return updated > 0
+
+    # ---- Quotas ----
+
+    async def now(self) -> datetime:
+        # Выдачи и счётчики по дням пишутся по часам процесса
+        return datetime.now()
+
+    async def get_quota_bucket(self, user_id: int) -> list[datetime]:
+        grants = await self._fetchval("SELECT grants FROM quota_buckets WHERE user_id = ?", user_id)
+        return [datetime.fromisoformat(g) for g in json.loads(grants)] if grants else []
+
+    async def get_user_quota(self, user_id: int):
+        return await self._fetchrow("""
+            SELECT u.tier, u.daily_limit, t.daily_limit AS tier_limit
+            FROM users u
+            LEFT JOIN quota_tiers t ON t.name = u.tier
+            WHERE u.user_id = ?
+        """, user_id)
+
+    async def set_user_limit(self, user_id: int, limit: int | None):
+        await self._execute("UPDATE users SET daily_limit = ? WHERE user_id = ?", limit, user_id)
+
+    async def set_user_tier(self, user_id: int, tier: str | None):
+        await self._execute("UPDATE users SET tier = ? WHERE user_id = ?", tier, user_id)
+
+    async def get_tiers(self):
+        return await self._fetch("SELECT name, daily_limit FROM quota_tiers ORDER BY daily_limit, name")
+
+    async def set_tier(self, name: str, limit: int):
+        await self._execute("""
+            INSERT INTO quota_tiers (name, daily_limit) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET daily_limit = excluded.daily_limit
+        """, name, limit)
+
+    async def delete_tier(self, name: str) -> bool:
+        return await self._execute("DELETE FROM quota_tiers WHERE name = ?", name) > 0
+
+    # ---- Settings ----
+
+    async def get_daily_limit(self) -> int:
+        val = await self._fetchval("SELECT value FROM settings WHERE key = 'daily_limit'")
+        return int(val) if val else 3
+
+    async def set_daily_limit(self, limit: int):
+        await self._execute("""
+            INSERT INTO settings (key, value) VALUES ('daily_limit', ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        """, str(limit))
+
+    async def get_quota_window(self) -> str:
+        val = await self._fetchval("SELECT value FROM settings WHERE key = 'quota_window'")
+        return val or "daily"
+
+    async def set_quota_window(self, mode: str):
+        await self._execute("""
+            INSERT INTO settings (key, value) VALUES ('quota_window', ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value
+        """, mode)
+
+    async def close(self):
+        if self.conn:
+            await self._call(self.conn.close)
+            self.conn = None